@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""should_translate() 微基准：对比旧实现与预编译正则实现的耗时，并校验两者结果一致
+
+用法：python3 benchmarks/bench_should_translate.py [--number N]
+"""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import translate_filter_v2
+
+def legacy_should_translate(text):
+    """改写前的实现，仅用于对比"""
+    if len(text) < 3:
+        return False
+    
+    has_chinese = any('一' <= char <= '鿿' for char in text)
+    if not has_chinese:
+        return False
+    
+    incomplete_punctuation = '，、；：'
+    if text.rstrip().endswith(tuple(incomplete_punctuation)):
+        return False
+    
+    import string
+    chinese_punctuation = '，。！？；：""''（）【】《》、'
+    all_punctuation = string.punctuation + chinese_punctuation
+    non_punct_chars = [char for char in text if char not in all_punctuation and not char.isspace()]
+    
+    if len(non_punct_chars) < 3:
+        return False
+    
+    if '，' in text:
+        comma_parts = text.split('，')
+        if len(comma_parts) == 2:
+            after_comma = comma_parts[1].strip()
+            after_comma_chars = [char for char in after_comma if char not in all_punctuation and not char.isspace()]
+            if len(after_comma_chars) <= 2:
+                return False
+    
+    return True
+
+SAMPLES = {
+    "short": "你好",
+    "typing": "今天天气不错，",
+    "sentence": "这个功能很实用，我每天都在用。",
+    "mixed": "请把 README.md 里的 install 步骤改成 pip install -e . 就行",
+    "paragraph": "这个功能很实用，我每天都在用它来翻译聊天消息。" * 100,
+}
+
+EDGE_CASES = [
+    "", "ab", "abc", "你好", "你好吗", "你好，", "你好，世", "你好，世界", "你好，世界，再见",
+    "，，，", "！！你好", "  你 好  ", "你好；", "hello 世界", "“你好”？", "(你)好[吗]",
+    "你好，　世界", "你好 ，世", "１２３你", "你好，世界！", "a，b，c中",
+]
+
+def check_equivalence():
+    """逐条比对新旧实现的结果"""
+    mismatches = []
+    for text in EDGE_CASES + list(SAMPLES.values()):
+        if legacy_should_translate(text) != translate_filter_v2.should_translate(text):
+            mismatches.append(text)
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="should_translate() 微基准")
+    parser.add_argument("--number", type=int, default=2000, help="每个样本的执行次数")
+    args = parser.parse_args()
+
+    mismatches = check_equivalence()
+    results = {"number": args.number, "mismatches": mismatches, "samples": {}}
+    for name, text in SAMPLES.items():
+        legacy = timeit.timeit(lambda: legacy_should_translate(text), number=args.number)
+        current = timeit.timeit(lambda: translate_filter_v2.should_translate(text), number=args.number)
+        results["samples"][name] = {
+            "length": len(text),
+            "legacy_us": legacy / args.number * 1e6,
+            "current_us": current / args.number * 1e6,
+            "speedup": legacy / current if current else None
+        }
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
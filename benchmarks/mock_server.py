@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""本地模拟的OpenAI兼容接口，供基准测试使用
+
+支持 /v1/chat/completions（普通和流式）和 /v1/models，可配置延迟、长尾延迟和错误注入。
+单独运行：python3 benchmarks/mock_server.py --port 8765 --latency 0.2
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+import http.server
+
+MODELS = ["gpt-4o-mini", "gpt-4o", "gpt-3.5-turbo", "text-embedding-3-small"]
+
+class MockState:
+    """服务端参数和请求计数，测试过程中可随时修改"""
+
+    def __init__(self, latency=0.1, token_interval=0.02, error_rate=0.0, error_status=500, seed=0,
+                 tail_rate=0.0, tail_latency=2.0):
+        self.latency = latency
+        # 以tail_rate的概率使用tail_latency作为首字节延迟，模拟接口的长尾延迟
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.model_requests = 0
+
+    def get_latency(self):
+        with self.lock:
+            if self.tail_rate and self.random.random() < self.tail_rate:
+                return self.tail_latency
+        return self.latency
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+def make_translation(content):
+    """生成确定性的"译文"：词数与原文长度相关，便于比较"""
+    words = max(1, len(content) // 2)
+    return " ".join(f"word{i}" for i in range(words))
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已取消请求（如对冲请求中较慢的一个）
+            self.close_connection = True
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith("/models"):
+            with self.state.lock:
+                self.state.model_requests += 1
+            # 带ETag，客户端重新验证且列表未变化时返回304
+            etag = f'"{len(MODELS)}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_json(200, {"object": "list", "data": [{"id": model, "object": "model"} for model in MODELS]}, {"ETag": etag})
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": {"message": "invalid json"}})
+            return
+        if not self.path.rstrip('/').endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        state = self.state
+        time.sleep(state.get_latency())
+        if state.should_fail():
+            headers = {"Retry-After": "0"} if state.error_status == 429 else None
+            self.send_json(state.error_status, {"error": {"message": "injected error"}}, headers)
+            return
+
+        content = request.get("messages", [{}])[-1].get("content", "")
+        translation = make_translation(content)
+        usage = {
+            "prompt_tokens": sum(len(m.get("content", "")) for m in request.get("messages", [])),
+            "completion_tokens": len(translation.split())
+        }
+        if not request.get("stream"):
+            self.send_json(200, {
+                "object": "chat.completion",
+                "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": translation}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = b"data: " + payload + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        try:
+            for word in translation.split(" "):
+                send_event(json.dumps({"choices": [{"index": 0, "delta": {"content": word + " "}}]}).encode('utf-8'))
+                time.sleep(state.token_interval)
+            send_event(b"[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消了请求（输入已变化）
+            self.close_connection = True
+
+def start_server(state, port=0):
+    """在后台线程启动服务，返回(server, base_url)"""
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟OpenAI兼容接口")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.1, help="每个请求的首字节延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="流式响应每个词的间隔（秒）")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="使用长尾延迟的概率")
+    parser.add_argument("--tail-latency", type=float, default=2.0, help="长尾延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的概率")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误时的HTTP状态码")
+    args = parser.parse_args()
+
+    state = MockState(
+        args.latency, args.token_interval, args.error_rate, args.error_status,
+        tail_rate=args.tail_rate, tail_latency=args.tail_latency
+    )
+    server, base_url = start_server(state, args.port)
+    print(f"模拟接口已启动：{base_url}/chat/completions", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""基准测试：启动本地模拟接口，驱动真实入口脚本，输出JSON结果
+
+测试项：
+- keystrokes: 逐字输入一句话，每次按键启动一次 translate_filter_v2.py（与Alfred相同），分冷缓存和热缓存
+- oneshot: translate.py 单次翻译
+- cache_scaling: 缓存中有1k/10k/100k条时的查询耗时
+- cold_start: 空输入、输入中、未配置API Key、缓存命中、未命中各路径的启动耗时和 -X importtime 导入耗时
+- hedging: 两个有长尾延迟的端点，关闭和开启对冲请求时单次翻译的延迟分布
+- daemon: 开启和关闭常驻进程时，缓存命中和未命中的Script Filter耗时
+
+用法：
+    python3 benchmarks/run_benchmarks.py -o results.json
+    python3 benchmarks/run_benchmarks.py --compare baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+import glob
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_server
+import metrics
+
+SENTENCE = "这个功能在日常聊天里非常实用。"
+# 流式模式下等待最终结果的最长时间（秒）
+STREAM_TIMEOUT = 30
+# 与基线比较时视为退化的变化比例
+REGRESSION_THRESHOLD = 0.2
+# hedging测试中模拟接口出现长尾延迟的概率和长尾延迟（秒）
+HEDGE_TAIL_RATE = 0.1
+HEDGE_TAIL_LATENCY = 2.0
+# 冷启动时关注是否被加载的较重模块
+# 运行中发现的错误结果，结束时有问题则以非零状态退出：延迟数据只有在结果正确时才有意义
+problems = []
+
+HEAVY_MODULES = ("ssl", "http.client", "urllib.request", "email.parser", "subprocess", "concurrent.futures", "socket", "hashlib", "sqlite3")
+
+def get_data_dir(home):
+    return os.path.join(home, "Library", "Application Support", "Alfred", "Workflow Data", "com.translator.alfred")
+
+def prepare_home(base_url, **config):
+    """创建独立的HOME目录并写入指向模拟接口的配置"""
+    home = tempfile.mkdtemp(prefix="translator-bench-")
+    data_dir = get_data_dir(home)
+    os.makedirs(data_dir)
+    settings = {
+        "api_url": f"{base_url}/chat/completions",
+        "api_key": "bench-key",
+        "model": "gpt-4o-mini",
+        "prompt": "请将以下中文翻译成自然、口语化的英文："
+    }
+    settings.update(config)
+    with open(os.path.join(data_dir, "config.json"), 'w', encoding='utf-8') as f:
+        json.dump(settings, f, ensure_ascii=False)
+    return home
+
+def make_env(home):
+    env = dict(os.environ, HOME=home, NO_PROXY="127.0.0.1,localhost", no_proxy="127.0.0.1,localhost")
+    for name in ("http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY", "all_proxy", "ALL_PROXY"):
+        env.pop(name, None)
+    return env
+
+def run_script(script, args, env):
+    """运行入口脚本，返回(读到标准输出EOF的耗时毫秒, 标准输出)
+
+    Alfred读到EOF即显示结果，之后的收尾操作（写缓存等）不计入耗时；仍等进程退出后再返回，各次运行互不重叠。
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, script)] + args,
+        env=env,
+        cwd=SRC_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    with process:
+        output = process.stdout.read()
+        elapsed = (time.perf_counter() - started) * 1000
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return elapsed, output.decode('utf-8', 'replace')
+
+def summarize(values):
+    """计算样本的统计值（毫秒）"""
+    if not values:
+        return {"n": 0}
+    values = sorted(values)
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(metrics.percentile(values, 50), 3),
+        "p95": round(metrics.percentile(values, 95), 3),
+        "p99": round(metrics.percentile(values, 99), 3),
+        "min": round(values[0], 3),
+        "max": round(values[-1], 3)
+    }
+
+def expect_translation(name, output, text):
+    """检查Script Filter的最终输出是text的完整译文（模拟接口的译文），否则记录问题"""
+    try:
+        item = json.loads(output)["items"][0]
+    except (ValueError, KeyError, IndexError, TypeError):
+        item = {}
+    if item.get("uid") != "translation" or not item.get("valid") or item.get("title") != mock_server.make_translation(text):
+        problems.append(f"{name}: 最终结果不是完整译文：{output.strip()[:200]}")
+
+def type_sentence(env, sentence):
+    """逐字输入，返回每次按键的耗时、最后一次按键到得到最终结果的耗时和最终输出"""
+    keystrokes = []
+    final_ms = None
+    output = ""
+    for length in range(1, len(sentence) + 1):
+        elapsed, output = run_script("translate_filter_v2.py", [sentence[:length]], env)
+        keystrokes.append(elapsed)
+    final_ms = keystrokes[-1]
+
+    # 流式模式：按Alfred的rerun继续调用，直到不再要求刷新
+    started = time.perf_counter() - final_ms / 1000
+    deadline = time.time() + STREAM_TIMEOUT
+    while '"rerun"' in output and time.time() < deadline:
+        time.sleep(0.1)
+        _, output = run_script("translate_filter_v2.py", [sentence], env)
+        final_ms = (time.perf_counter() - started) * 1000
+    return keystrokes, final_ms, output
+
+def bench_keystrokes(state, base_url, runs, stream):
+    """逐字输入的按键延迟，冷缓存（首次输入）和热缓存（重复输入）"""
+    cold, warm, cold_final, warm_final = [], [], [], []
+    requests_before = state.requests
+    for _ in range(runs):
+        home = prepare_home(base_url, stream=stream)
+        env = make_env(home)
+        try:
+            keystrokes, final_ms, output = type_sentence(env, SENTENCE)
+            expect_translation("stream.cold" if stream else "keystrokes.cold", output, SENTENCE)
+            cold.extend(keystrokes)
+            cold_final.append(final_ms)
+            keystrokes, final_ms, output = type_sentence(env, SENTENCE)
+            expect_translation("stream.warm" if stream else "keystrokes.warm", output, SENTENCE)
+            warm.extend(keystrokes)
+            warm_final.append(final_ms)
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+    return {
+        "cold_keystroke_ms": summarize(cold),
+        "warm_keystroke_ms": summarize(warm),
+        "cold_final_ms": summarize(cold_final),
+        "warm_final_ms": summarize(warm_final),
+        "api_requests_per_run": (state.requests - requests_before) / runs
+    }
+
+def bench_oneshot(base_url, runs):
+    """translate.py 单次翻译（不使用缓存）"""
+    home = prepare_home(base_url)
+    env = make_env(home)
+    samples = []
+    try:
+        for index in range(runs):
+            text = f"{SENTENCE}{index}"
+            elapsed, output = run_script("translate.py", [text], env)
+            if output.strip() != mock_server.make_translation(text):
+                problems.append(f"oneshot: 输出不是完整译文：{output.strip()[:200]}")
+            samples.append(elapsed)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    return {"latency_ms": summarize(samples)}
+
+def populate_cache(data_dir, size):
+    """直接向缓存数据库写入size条记录"""
+    import translation_cache
+    conn = translation_cache.connect_cache(data_dir)
+    now = time.time()
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO translations (key, source, translation, timestamp, last_access) VALUES (?, ?, ?, ?, ?)",
+        ((f"bench-{i:08d}", f"原文{i}", f"translation {i}", now, now) for i in range(size))
+    )
+    conn.execute("COMMIT")
+    conn.close()
+
+def bench_cache_scaling(base_url, sizes, lookups):
+    """不同缓存大小下的查询耗时：进程内查询（关闭内存缓存）和完整的Script Filter调用"""
+    import translation_engine
+    results = {}
+    for size in sizes:
+        home = prepare_home(base_url, cache_memory_entries=0)
+        env = make_env(home)
+        try:
+            populate_cache(get_data_dir(home), size)
+            # 在当前进程中切换到该HOME
+            os.environ["HOME"] = home
+            translation_engine.set_workflow_data_dir(get_data_dir(home))
+            config = translation_engine.load_config()
+            text = "这是一句缓存里已经有的话"
+            translation_engine.store_cache(text, config, "This is already cached")
+            translation_engine.run_deferred()
+
+            hits, misses = [], []
+            for index in range(lookups):
+                started = time.perf_counter()
+                translation_engine.lookup_cache(text, config)
+                hits.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                translation_engine.lookup_cache(f"没有缓存的句子{index}", config)
+                misses.append((time.perf_counter() - started) * 1000)
+
+            filter_hits = [run_script("translate_filter_v2.py", [text], env)[0] for _ in range(max(3, lookups // 50))]
+            results[str(size)] = {
+                "lookup_hit_ms": summarize(hits),
+                "lookup_miss_ms": summarize(misses),
+                "filter_hit_ms": summarize(filter_hits),
+                "db_bytes": os.path.getsize(os.path.join(get_data_dir(home), "translation_cache.db"))
+            }
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+            translation_engine.set_workflow_data_dir(None)
+    return results
+
+def measure_imports(args, env):
+    """以 -X importtime 运行Script Filter，返回(各模块自身导入耗时之和微秒, 已加载的较重模块)"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(SRC_DIR, "translate_filter_v2.py")] + args,
+        env=env,
+        cwd=SRC_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        timeout=60
+    )
+    total = 0
+    loaded = set()
+    for line in completed.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        total += int(self_us)
+        loaded.add(name.strip())
+    return total, sorted(name for name in HEAVY_MODULES if name in loaded)
+
+def bench_cold_start(base_url, runs):
+    """各路径的进程耗时和导入耗时；缓存命中等路径不应加载网络模块"""
+    home = prepare_home(base_url)
+    no_key_home = prepare_home(base_url, api_key="")
+    env = make_env(home)
+    cached_text = "这句话已经翻译过并写入了缓存"
+    run_script("translate_filter_v2.py", [cached_text], env)
+    paths = {
+        "empty": (env, lambda index: []),
+        "waiting": (env, lambda index: ["你好"]),
+        "missing_key": (make_env(no_key_home), lambda index: [SENTENCE]),
+        "cache_hit": (env, lambda index: [cached_text]),
+        "miss": (env, lambda index: [f"{SENTENCE}第{index}次"])
+    }
+    results = {}
+    try:
+        for name, (path_env, make_args) in paths.items():
+            wall = [run_script("translate_filter_v2.py", make_args(index), path_env)[0] for index in range(runs)]
+            import_us, heavy = measure_imports(make_args(runs), path_env)
+            results[name] = {
+                "wall_ms": summarize(wall),
+                "import_ms": round(import_us / 1000, 3),
+                "heavy_modules": heavy
+            }
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+        shutil.rmtree(no_key_home, ignore_errors=True)
+    return results
+
+def bench_hedging(latency, runs):
+    """两个端点都有长尾延迟时，关闭和开启对冲请求的单次翻译耗时（进程内调用，每次都是新原文）"""
+    import translation_engine
+    servers = []
+    urls = []
+    for seed in (1, 2):
+        state = mock_server.MockState(latency, seed=seed, tail_rate=HEDGE_TAIL_RATE, tail_latency=HEDGE_TAIL_LATENCY)
+        server, base_url = mock_server.start_server(state)
+        servers.append((server, state))
+        urls.append(f"{base_url}/chat/completions")
+
+    original_environ = dict(os.environ)
+    results = {}
+    try:
+        for hedge in (False, True):
+            requests_before = sum(state.requests for _, state in servers)
+            home = prepare_home(urls[0][:-len("/chat/completions")], endpoints=[{"api_url": urls[1]}], hedge_requests=hedge)
+            os.environ.clear()
+            os.environ.update(make_env(home))
+            translation_engine.set_workflow_data_dir(get_data_dir(home))
+            config = translation_engine.load_config()
+            samples = []
+            try:
+                for index in range(runs):
+                    started = time.perf_counter()
+                    translation_engine.translate_text(f"{SENTENCE}{hedge}{index}", config)
+                    samples.append((time.perf_counter() - started) * 1000)
+                    translation_engine.run_deferred()
+            finally:
+                shutil.rmtree(home, ignore_errors=True)
+            results["hedged" if hedge else "single"] = {
+                "latency_ms": summarize(samples),
+                "api_requests": sum(state.requests for _, state in servers) - requests_before
+            }
+    finally:
+        os.environ.clear()
+        os.environ.update(original_environ)
+        translation_engine.set_workflow_data_dir(None)
+        for server, _ in servers:
+            server.shutdown()
+    return results
+
+def bench_daemon(base_url, runs):
+    """常驻进程：缓存命中和未命中时Script Filter的耗时，与不使用常驻进程时对比"""
+    results = {}
+    for name, use_daemon in (("process", False), ("daemon", True)):
+        home = prepare_home(base_url, use_daemon=use_daemon)
+        env = make_env(home)
+        # socket放在临时目录中，不影响正在运行的常驻进程
+        env["TMPDIR"] = os.path.join(home, "tmp")
+        os.makedirs(env["TMPDIR"])
+        daemon = None
+        hit, miss = [], []
+        try:
+            if use_daemon:
+                daemon = subprocess.Popen(
+                    [sys.executable, os.path.join(SRC_DIR, "translate_daemon.py")],
+                    env=env,
+                    cwd=SRC_DIR,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+                deadline = time.time() + 10
+                while not glob.glob(os.path.join(env["TMPDIR"], "*", "daemon.sock")) and time.time() < deadline:
+                    time.sleep(0.05)
+            _, output = run_script("translate_filter_v2.py", [SENTENCE], env)
+            expect_translation(f"daemon.{name}", output, SENTENCE)
+            for index in range(runs):
+                elapsed, output = run_script("translate_filter_v2.py", [SENTENCE], env)
+                expect_translation(f"daemon.{name}.cache_hit", output, SENTENCE)
+                hit.append(elapsed)
+                text = f"{SENTENCE}第{index}次"
+                elapsed, output = run_script("translate_filter_v2.py", [text], env)
+                expect_translation(f"daemon.{name}.miss", output, text)
+                miss.append(elapsed)
+        finally:
+            if daemon is not None:
+                daemon.terminate()
+                daemon.wait()
+            shutil.rmtree(home, ignore_errors=True)
+        results[name] = {"cache_hit_ms": summarize(hit), "miss_ms": summarize(miss)}
+    return results
+
+def flatten(results, prefix=""):
+    """展开嵌套结果，便于逐项比较"""
+    items = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            items.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            items[name] = value
+    return items
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """与基线比较各项p50耗时，返回变慢超过阈值的项"""
+    current_items = flatten(current["results"])
+    baseline_items = flatten(baseline.get("results", {}))
+    regressions = []
+    for name, value in sorted(current_items.items()):
+        if not name.endswith(".p50") or name not in baseline_items:
+            continue
+        base = baseline_items[name]
+        change = (value - base) / base if base else 0.0
+        marker = "  ⚠ 退化" if change > threshold else ""
+        print(f"{name}: {base:.2f} → {value:.2f} ms ({change:+.0%}){marker}", file=sys.stderr)
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="翻译workflow基准测试")
+    parser.add_argument("-o", "--output", help="结果JSON文件，默认输出到标准输出")
+    parser.add_argument("--runs", type=int, default=3, help="按键序列和单次翻译的重复次数")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="缓存规模，逗号分隔")
+    parser.add_argument("--lookups", type=int, default=500, help="每个缓存规模的查询次数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟接口的首字节延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="流式响应每个词的间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟接口返回错误的概率")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的HTTP状态码")
+    parser.add_argument("--only", help="只运行指定测试项，逗号分隔（keystrokes,stream,oneshot,cache_scaling,cold_start,hedging,daemon）")
+    parser.add_argument("--quick", action="store_true", help="快速模式：减少重复次数和缓存规模")
+    parser.add_argument("--compare", help="与之前保存的结果比较，p50变慢超过20%%时以非零状态退出")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.runs = 1
+        args.sizes = "1000,10000"
+        args.lookups = 100
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    selected = set(args.only.split(",")) if args.only else {"keystrokes", "stream", "oneshot", "cache_scaling", "cold_start", "hedging", "daemon"}
+
+    state = mock_server.MockState(args.latency, args.token_interval, args.error_rate, args.error_status)
+    server, base_url = mock_server.start_server(state)
+    original_home = os.environ.get("HOME")
+    results = {}
+    try:
+        if "keystrokes" in selected:
+            results["keystrokes"] = bench_keystrokes(state, base_url, args.runs, stream=False)
+        if "stream" in selected:
+            results["stream"] = bench_keystrokes(state, base_url, args.runs, stream=True)
+        if "oneshot" in selected:
+            results["oneshot"] = bench_oneshot(base_url, args.runs * 5)
+        if "cache_scaling" in selected:
+            results["cache_scaling"] = bench_cache_scaling(base_url, sizes, args.lookups)
+        if "cold_start" in selected:
+            results["cold_start"] = bench_cold_start(base_url, args.runs * 5)
+        if "hedging" in selected:
+            results["hedging"] = bench_hedging(args.latency, args.runs * 40)
+        if "daemon" in selected:
+            results["daemon"] = bench_daemon(base_url, args.runs * 10)
+    finally:
+        server.shutdown()
+        if original_home is not None:
+            os.environ["HOME"] = original_home
+
+    if not args.error_rate and state.errors:
+        problems.append(f"未注入错误，模拟接口却返回了{state.errors}次错误")
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "runs": args.runs,
+            "mock_requests": state.requests,
+            "mock_errors": state.errors
+        },
+        "results": results,
+        "problems": problems
+    }
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(output, json.load(f))
+    for problem in problems:
+        print(f"✗ {problem}", file=sys.stderr)
+    if problems or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
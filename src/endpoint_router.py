@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+import threading
+import metrics
+
+# 构成一个端点的配置项，endpoints中未填写的项沿用主配置
+ENDPOINT_KEYS = ("api_url", "api_key", "model")
+# 延迟EWMA的平滑系数，越大越看重最近的请求
+EWMA_ALPHA = 0.3
+# 每个端点保留的最近延迟样本数，用于计算p95
+MAX_SAMPLES = 50
+# 延迟数据超过该时间未更新时重新探测一次（秒），慢端点恢复后能被重新选中
+PROBE_INTERVAL = 600
+# 请求失败后暂停使用该端点的时间（秒），连续失败时翻倍，不超过MAX_COOLDOWN
+BASE_COOLDOWN = 15
+MAX_COOLDOWN = 300
+# 对冲请求的等待时间取首选端点延迟的p95，限制在此范围内（秒）；样本不足时使用默认值
+HEDGE_MIN_DELAY = 0.3
+HEDGE_MAX_DELAY = 5.0
+HEDGE_DEFAULT_DELAY = 1.5
+MIN_HEDGE_SAMPLES = 5
+# 连续失败达到该次数后熔断：冷却期内不再发请求，直接返回上次的错误；可通过配置breaker_failures修改
+BREAKER_FAILURES = 3
+# 熔断冷却期过后只放行一个探测请求，探测超过该时间（秒）未结束时允许其他进程再探测
+PROBE_TIMEOUT = 35
+
+def get_state_file(data_dir):
+    """获取端点延迟和健康状态文件路径"""
+    return os.path.join(data_dir, "endpoints.json")
+
+def endpoint_id(endpoint):
+    """端点标识：接口地址、模型和API Key的摘要，更换Key后延迟和熔断状态重新统计"""
+    key = hashlib.md5(endpoint.get('api_key', '').encode('utf-8')).hexdigest()[:8]
+    return f"{endpoint.get('api_url', '')}|{endpoint.get('model', '')}|{key}"
+
+def get_entry(state, endpoint):
+    """端点的延迟和健康状态，没有记录时返回空字典"""
+    return state.get(endpoint_id(endpoint), {})
+
+def get_endpoints(config):
+    """返回端点列表：主配置在前，config["endpoints"]中的端点在后
+
+    每个端点是替换了api_url、api_key、model的完整配置，可以直接用于构建请求。
+    """
+    endpoints = [config]
+    seen = {endpoint_id(config)}
+    for extra in config.get("endpoints") or []:
+        if not isinstance(extra, dict):
+            continue
+        endpoint = dict(config)
+        endpoint.update({key: extra[key] for key in ENDPOINT_KEYS if extra.get(key)})
+        if endpoint_id(endpoint) in seen:
+            continue
+        seen.add(endpoint_id(endpoint))
+        endpoints.append(endpoint)
+    return endpoints
+
+def load_state(data_dir):
+    """读取各端点的延迟和健康状态"""
+    try:
+        with open(get_state_file(data_dir), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _update_state(data_dir, update):
+    """在文件锁保护下读取并修改状态文件，多个进程同时记录时互不覆盖；update(state)就地修改状态"""
+    import translation_engine
+
+    def apply(state):
+        state = state if isinstance(state, dict) else {}
+        update(state)
+        return state
+
+    translation_engine.update_json_file(get_state_file(data_dir), apply)
+
+def rank(state, endpoints, kind):
+    """按健康状态和延迟排序：可用的在前，延迟EWMA低的优先
+
+    kind区分普通请求（complete，完整耗时）和流式请求（stream，首字耗时）。
+    没有延迟数据或数据已过时的端点视为最快，先试一次以获得数据。
+    """
+    now = time.time()
+
+    def sort_key(endpoint):
+        entry = state.get(endpoint_id(endpoint), {})
+        if entry.get("down_until", 0) > now:
+            return (1, entry["down_until"])
+        stats = entry.get(kind, {})
+        if now - stats.get("updated", 0) > PROBE_INTERVAL:
+            return (0, 0)
+        return (0, stats.get("ewma", 0))
+
+    # 排序稳定，延迟相同时保持配置顺序
+    return sorted(endpoints, key=sort_key)
+
+def hedge_delay(state, endpoint, kind):
+    """对冲请求的等待时间：端点最近延迟的p95"""
+    samples = state.get(endpoint_id(endpoint), {}).get(kind, {}).get("samples", [])
+    if len(samples) < MIN_HEDGE_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, min(HEDGE_MAX_DELAY, metrics.percentile(samples, 95)))
+
+def record(data_dir, endpoint, kind, latency, lower_bound=False, error=None):
+    """记录一次请求：latency为耗时（秒），None表示请求失败，此时error为失败的结果字典
+
+    lower_bound表示请求被取消，latency只是延迟的下限，仅在比当前EWMA更慢时记录。
+    失败时记下错误信息，熔断期间直接显示；服务端给出Retry-After时冷却期至少持续到该时间。
+    """
+    ident = endpoint_id(endpoint)
+
+    def update(state):
+        now = time.time()
+        entry = state.setdefault(ident, {})
+        if latency is None:
+            entry.pop("probe_until", None)
+            entry.pop("probe_pid", None)
+            entry["failures"] = entry.get("failures", 0) + 1
+            entry["down_until"] = now + min(MAX_COOLDOWN, BASE_COOLDOWN * 2 ** (entry["failures"] - 1))
+            if error:
+                entry["last_error"] = error.get("text")
+                entry["last_status"] = error.get("http_status")
+                if error.get("retry_after"):
+                    entry["down_until"] = max(entry["down_until"], now + error["retry_after"])
+            return
+        previous = entry.get(kind, {}).get("ewma")
+        if lower_bound and (previous is None or latency <= previous):
+            return
+        stats = entry.setdefault(kind, {})
+        for name in ("probe_until", "probe_pid", "last_error", "last_status"):
+            entry.pop(name, None)
+        entry["failures"] = 0
+        entry["down_until"] = 0
+        stats["ewma"] = latency if previous is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * previous
+        stats["samples"] = (stats.get("samples", []) + [round(latency, 3)])[-MAX_SAMPLES:]
+        stats["updated"] = now
+
+    try:
+        _update_state(data_dir, update)
+    except OSError:
+        pass
+
+def allow(data_dir, state, endpoint, threshold=BREAKER_FAILURES):
+    """熔断检查：是否允许向端点发请求
+
+    连续失败不到threshold次时总是允许；达到后冷却期内拒绝，冷却期过后（半开）只有一个进程能
+    占到探测名额，探测成功后恢复，失败则进入更长的冷却期。占到名额的请求结束后应调用release_probe()。
+    """
+    entry = get_entry(state, endpoint)
+    if entry.get("failures", 0) < threshold:
+        return True
+    now = time.time()
+    if entry.get("down_until", 0) > now or entry.get("probe_until", 0) > now:
+        return False
+    ident = endpoint_id(endpoint)
+    claimed = []
+
+    def update(state):
+        # 加锁后重新检查，其他进程可能已占到探测名额或已恢复
+        current = state.setdefault(ident, {})
+        if current.get("down_until", 0) > now or current.get("probe_until", 0) > now:
+            return
+        current["probe_until"] = now + PROBE_TIMEOUT
+        current["probe_pid"] = os.getpid()
+        claimed.append(True)
+
+    try:
+        _update_state(data_dir, update)
+    except OSError:
+        return True
+    return bool(claimed)
+
+def is_probing(state, endpoint, threshold=BREAKER_FAILURES):
+    """allow()放行该端点是否意味着占用了半开探测名额"""
+    return get_entry(state, endpoint).get("failures", 0) >= threshold
+
+def release_probe(data_dir, endpoint):
+    """交还当前进程占用的探测名额
+
+    探测请求被取消、返回内容错误或进程被终止时不会调用record()，不交还的话其他进程要等PROBE_TIMEOUT
+    过后才能再探测，期间一直直接显示熔断错误。
+    """
+    ident = endpoint_id(endpoint)
+    pid = os.getpid()
+
+    def update(state):
+        entry = state.get(ident)
+        if entry and entry.get("probe_pid") == pid:
+            entry.pop("probe_until", None)
+            entry.pop("probe_pid", None)
+
+    try:
+        _update_state(data_dir, update)
+    except OSError:
+        pass
+
+def run_routed(calls, delay=None, cancel=None):
+    """按顺序向各端点发出请求，返回第一个成功的(结果, None)，全部失败时返回(None, 最后的错误)
+
+    calls中每一项为call(cancel, claim)，返回(结果, 错误)，调用抛出异常时以异常对象作为错误：cancel是传给http_client的CancelToken，
+    claim()在开始产生结果（如收到第一段流式内容）时调用，返回False说明其他请求已胜出，应放弃本次请求。
+    请求失败时立即向下一个端点请求；delay不为None时，当前请求超过delay秒仍未返回也会向下一个端点
+    发出对冲请求。先成功的请求胜出，其余请求被取消。cancel为整个查询的CancelToken，取消时所有请求一起取消。
+    """
+    import queue
+    import http_client
+    tokens = [http_client.CancelToken(cancel) for _ in calls]
+    outcomes = queue.Queue()
+    lock = threading.Lock()
+    winner = []
+
+    def claim(index):
+        with lock:
+            if not winner:
+                winner.append(index)
+                for other, token in enumerate(tokens):
+                    if other != index:
+                        token.cancel()
+            return winner[0] == index
+
+    def run(index):
+        try:
+            result, error = calls[index](tokens[index], lambda: claim(index))
+        except Exception as e:
+            result, error = None, e
+        if error is None:
+            claim(index)
+        outcomes.put((index, result, error))
+
+    launched = 0
+    running = 0
+
+    def launch():
+        nonlocal launched, running
+        # 守护线程：被取消的请求不会阻止进程退出
+        threading.Thread(target=run, args=(launched,), daemon=True).start()
+        launched += 1
+        running += 1
+
+    launch()
+    last_error = None
+    while running:
+        can_hedge = delay is not None and launched < len(calls) and not winner
+        try:
+            index, result, error = outcomes.get(timeout=delay if can_hedge else None)
+        except queue.Empty:
+            launch()
+            continue
+        running -= 1
+        if winner:
+            if winner[0] == index:
+                return result, error
+            # 已被取消的请求
+            continue
+        last_error = error
+        if launched < len(calls):
+            # 请求失败，立即换下一个端点
+            launch()
+    return None, last_error
\ No newline at end of file
@@ -2,10 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import subprocess
+import metrics
 
 def speak_text(text):
     """使用系统语音朗读文本"""
+    # 普通复制无需子进程，只在朗读时导入
+    import subprocess
     try:
         # 使用macOS的say命令，选择更好的英文语音
         subprocess.run(["say", "-v", "Alex", text], check=False)
@@ -21,15 +23,20 @@ def main():
         return
     
     arg = sys.argv[1].strip()
+    metrics.start("action")
     
     if arg.startswith("speak:"):
         # 朗读功能
         text_to_speak = arg[6:]  # 移除 "speak:" 前缀
-        speak_text(text_to_speak)
-        print(text_to_speak)  # 同时输出到剪贴板
+        with metrics.span("speak"):
+            speak_text(text_to_speak)
+        with metrics.span("output"):
+            print(text_to_speak)  # 同时输出到剪贴板
     else:
         # 普通复制功能
-        print(arg)
+        with metrics.span("output"):
+            print(arg)
+    metrics.flush()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import ssl
+import sys
+import time
+import socket
+import threading
+import http.client
+import urllib.parse
+import urllib.error
+
+# 每个主机最多保留的空闲连接数
+MAX_IDLE_PER_HOST = 4
+# 空闲超过该时间的连接不再复用（秒），服务端通常会更早关闭
+IDLE_TIMEOUT = 60
+# 与urllib一致：GET/HEAD请求跟随这些重定向，最多MAX_REDIRECTS次
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+
+# (scheme, host, port) -> [(连接, 放回时间)]
+_pool = {}
+_pool_lock = threading.Lock()
+_ssl_context = None
+# 代理设置在进程内只读取一次（macOS上要查询系统设置）
+_proxies = None
+
+# 复用的连接可能已被服务端关闭，遇到这些异常时换新连接重试一次
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    BrokenPipeError
+)
+
+class CancelToken:
+    """从其他线程取消进行中的请求：cancel()会关闭请求正在使用的连接，阻塞中的读写随即出错返回
+
+    parent不为None时随parent一起取消（如一次查询取消时，其对冲的各个请求都被取消）。
+    """
+
+    def __init__(self, parent=None):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._children = []
+        self.cancelled = False
+        if parent is not None:
+            parent._add_child(self)
+
+    def _add_child(self, child):
+        with self._lock:
+            if not self.cancelled:
+                self._children.append(child)
+                return
+        child.cancel()
+
+    def attach(self, conn):
+        """登记请求使用的连接，已取消时返回False"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._conn = conn
+            return True
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            conn = self._conn
+            children, self._children = self._children, []
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for child in children:
+            child.cancel()
+
+class PooledResponse:
+    """连接池中的HTTP响应，用法与urllib.request.urlopen的返回值一致"""
+
+    def __init__(self, key, conn, response, timings, started):
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._started = started
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        # connect: DNS+TCP建连, tls: TLS握手, ttfb: 发出请求到收到响应头, total: 完整耗时
+        self.timings = timings
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        self._check_finished()
+        return data
+
+    def readline(self):
+        line = self._response.readline()
+        self._check_finished()
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def _check_finished(self):
+        if self._response.isclosed() and self.timings.get('total') is None:
+            self.timings['total'] = time.perf_counter() - self._started
+
+    def close(self):
+        """读完的连接放回连接池，未读完的直接关闭"""
+        if self._conn is None:
+            return
+        self._check_finished()
+        if self._response.isclosed() and not self._response.will_close:
+            _release(self._key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+def _get_proxy(scheme, host):
+    """与urllib.request.urlopen相同的代理设置：环境变量优先，macOS上没有时读取系统代理设置"""
+    global _proxies
+    if sys.platform != 'darwin' and not any(name.lower().endswith('_proxy') for name in os.environ):
+        return None
+    import urllib.request
+    if _proxies is None:
+        _proxies = urllib.request.getproxies()
+    proxy = _proxies.get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    # 系统设置中的代理可能没有协议前缀
+    return proxy if '://' in proxy else f'http://{proxy}'
+
+def _get_proxy_auth(proxy_url):
+    """代理地址中带有user:pass@时生成Proxy-Authorization请求头，否则返回None"""
+    if proxy_url.username is None:
+        return None
+    import base64
+    credentials = f"{urllib.parse.unquote(proxy_url.username)}:{urllib.parse.unquote(proxy_url.password or '')}"
+    return 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+
+def _new_connection(scheme, host, port, timeout):
+    """新建连接对象（尚未建连），返回(连接, 是否经过代理)"""
+    connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+    kwargs = {'timeout': timeout}
+    if scheme == 'https':
+        kwargs['context'] = _get_ssl_context()
+
+    proxy = _get_proxy(scheme, host)
+    if proxy:
+        proxy_url = urllib.parse.urlsplit(proxy)
+        auth = _get_proxy_auth(proxy_url)
+        if scheme == 'https':
+            # HTTPS经代理时用CONNECT隧道，连接仍可复用
+            conn = connection_class(proxy_url.hostname, proxy_url.port or 80, **kwargs)
+            conn.set_tunnel(host, port, headers={'Proxy-Authorization': auth} if auth else None)
+        else:
+            conn = http.client.HTTPConnection(proxy_url.hostname, proxy_url.port or 80, timeout=timeout)
+        return conn, True
+
+    return connection_class(host, port, **kwargs), False
+
+def _connect(conn, scheme, host, port, timeout, timings):
+    """手动建连以分别记录TCP和TLS耗时"""
+    started = time.perf_counter()
+    sock = socket.create_connection((host, port), timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    timings['connect'] = time.perf_counter() - started
+
+    if scheme == 'https':
+        started = time.perf_counter()
+        try:
+            sock = _get_ssl_context().wrap_socket(sock, server_hostname=host)
+        except Exception:
+            sock.close()
+            raise
+        timings['tls'] = time.perf_counter() - started
+    conn.sock = sock
+
+def _acquire(key, timeout):
+    """从连接池取出空闲连接，没有则返回None"""
+    now = time.time()
+    with _pool_lock:
+        idle = _pool.get(key, [])
+        while idle:
+            conn, released = idle.pop()
+            if now - released < IDLE_TIMEOUT and conn.sock is not None:
+                conn.sock.settimeout(timeout)
+                return conn
+            conn.close()
+    return None
+
+def _release(key, conn):
+    """把连接放回连接池"""
+    with _pool_lock:
+        idle = _pool.setdefault(key, [])
+        if len(idle) < MAX_IDLE_PER_HOST:
+            idle.append((conn, time.time()))
+            return
+    conn.close()
+
+def preconnect(url, timeout=10):
+    """预先建立到url所在主机的连接（DNS解析、TCP、TLS握手）并放入连接池
+
+    已有空闲连接时不再新建，返回None；否则返回建连耗时。建连失败时抛出urllib.error.URLError。
+    """
+    parsed = urllib.parse.urlsplit(url)
+    scheme = parsed.scheme or 'https'
+    host = parsed.hostname
+    port = parsed.port or (443 if scheme == 'https' else 80)
+    key = (scheme, host, port)
+    now = time.time()
+    with _pool_lock:
+        if any(now - released < IDLE_TIMEOUT for _, released in _pool.get(key, [])):
+            return None
+
+    timings = {'connect': 0.0, 'tls': 0.0}
+    conn, proxied = _new_connection(scheme, host, port, timeout)
+    try:
+        if proxied:
+            conn.connect()
+        else:
+            _connect(conn, scheme, host, port, timeout, timings)
+    except (OSError, http.client.HTTPException) as e:
+        conn.close()
+        raise urllib.error.URLError(e)
+    _release(key, conn)
+    return timings
+
+def urlopen(url, data=None, headers=None, method=None, timeout=30, cancel=None):
+    """发送HTTP请求，复用同一主机的keep-alive连接
+
+    HTTP错误码和网络错误分别抛出urllib.error.HTTPError和URLError，
+    与urllib.request.urlopen保持一致。cancel为CancelToken时可从其他线程取消请求。
+    GET/HEAD请求跟随重定向；其他请求遇到重定向时抛出HTTPError（重发请求体可能改变语义）。
+    """
+    method = method or ('POST' if data is not None else 'GET')
+    headers = dict(headers or {})
+    for _ in range(MAX_REDIRECTS):
+        response = _open(url, data, headers, method, timeout, cancel)
+        if response.status not in REDIRECT_STATUSES:
+            return response
+        location = response.getheader('Location')
+        body = response.read()
+        response.close()
+        if not location or method not in ('GET', 'HEAD'):
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+        target = urllib.parse.urljoin(url, location)
+        if urllib.parse.urlsplit(target).netloc != urllib.parse.urlsplit(url).netloc:
+            # 跳转到其他主机时不转发API Key
+            headers = {name: value for name, value in headers.items() if name.lower() != 'authorization'}
+        url = target
+    raise urllib.error.HTTPError(url, response.status, "重定向次数过多", response.headers, io.BytesIO(b""))
+
+def _open(url, data, headers, method, timeout, cancel):
+    """发送一次HTTP请求，不处理重定向"""
+    parsed = urllib.parse.urlsplit(url)
+    scheme = parsed.scheme or 'https'
+    host = parsed.hostname
+    port = parsed.port or (443 if scheme == 'https' else 80)
+    key = (scheme, host, port)
+    path = parsed.path or '/'
+    if parsed.query:
+        path += '?' + parsed.query
+    headers = dict(headers)
+    headers.setdefault('Connection', 'keep-alive')
+
+    if scheme == 'http':
+        proxy = _get_proxy(scheme, host)
+        if proxy:
+            # 经HTTP代理时请求行需要完整URL
+            path = url
+            auth = _get_proxy_auth(urllib.parse.urlsplit(proxy))
+            if auth:
+                headers['Proxy-Authorization'] = auth
+
+    for attempt in range(2):
+        started = time.perf_counter()
+        conn = _acquire(key, timeout) if attempt == 0 else None
+        reused = conn is not None
+        timings = {'reused': reused, 'connect': 0.0, 'tls': 0.0, 'ttfb': None, 'total': None}
+
+        try:
+            if conn is None:
+                conn, proxied = _new_connection(scheme, host, port, timeout)
+                if proxied:
+                    conn.connect()
+                else:
+                    _connect(conn, scheme, host, port, timeout, timings)
+            if cancel is not None and not cancel.attach(conn):
+                conn.close()
+                raise urllib.error.URLError("请求已取消")
+
+            request_started = time.perf_counter()
+            conn.request(method, path, body=data, headers=headers)
+            response = conn.getresponse()
+            timings['ttfb'] = time.perf_counter() - request_started
+        except _STALE_ERRORS as e:
+            conn.close()
+            if reused and not (cancel is not None and cancel.cancelled):
+                continue
+            raise urllib.error.URLError(e)
+        except urllib.error.URLError:
+            raise
+        except OSError as e:
+            if conn is not None:
+                conn.close()
+            raise urllib.error.URLError(e)
+        except http.client.HTTPException as e:
+            conn.close()
+            raise urllib.error.URLError(e)
+
+        pooled = PooledResponse(key, conn, response, timings, started)
+        if response.status >= 400:
+            body = pooled.read()
+            pooled.close()
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+        return pooled
\ No newline at end of file
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import signal
+
+# 持有者超过该时间仍未完成视为已失效（秒），需覆盖一次完整的API调用
+LOCK_STALE_SECONDS = 35
+# 等待其他进程结果时的轮询间隔（秒）
+POLL_INTERVAL = 0.05
+
+def get_inflight_dir(data_dir):
+    """获取进行中请求的记录目录"""
+    inflight_dir = os.path.join(data_dir, "inflight")
+    if not os.path.exists(inflight_dir):
+        os.makedirs(inflight_dir, exist_ok=True)
+    return inflight_dir
+
+def _pid_alive(pid):
+    """判断进程是否仍在运行"""
+    if not pid or pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _lock_owner(lock_file):
+    """读取锁文件中的持有者，锁已失效时返回None"""
+    try:
+        with open(lock_file, 'r') as f:
+            pid = int(f.read().strip() or 0)
+        if time.time() - os.path.getmtime(lock_file) > LOCK_STALE_SECONDS:
+            return None
+    except (OSError, ValueError):
+        return None
+    return pid if pid and _pid_alive(pid) else None
+
+def acquire(data_dir, key):
+    """尝试成为该缓存键的请求持有者，已有其他进程在请求时返回False"""
+    lock_file = os.path.join(get_inflight_dir(data_dir), f"{key}.lock")
+    for attempt in range(2):
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except FileExistsError:
+            if _lock_owner(lock_file) is not None:
+                return False
+            # 持有者已退出，清理后重试
+            try:
+                os.remove(lock_file)
+            except OSError:
+                pass
+            continue
+        except OSError:
+            # 无法记录时按持有者处理，退化为各自请求
+            return True
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        return True
+    return True
+
+def is_inflight(data_dir, key):
+    """该缓存键是否已有进程在请求"""
+    return _lock_owner(os.path.join(get_inflight_dir(data_dir), f"{key}.lock")) is not None
+
+def release(data_dir, key):
+    """释放请求持有者身份"""
+    try:
+        os.remove(os.path.join(get_inflight_dir(data_dir), f"{key}.lock"))
+    except OSError:
+        pass
+
+def wait_for(data_dir, key, lookup, timeout=LOCK_STALE_SECONDS):
+    """等待持有者完成请求，返回lookup()查到的结果；持有者失败或超时返回None
+
+    持有者是当前进程时不等待：它的缓存写入和释放推迟到输出结果之后，在此之前等不到结果。
+    """
+    lock_file = os.path.join(get_inflight_dir(data_dir), f"{key}.lock")
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = lookup()
+        if result is not None:
+            return result
+        owner = _lock_owner(lock_file)
+        if owner is None or owner == os.getpid():
+            # 持有者已结束但没有写入结果，或持有者就是当前进程
+            return lookup()
+        time.sleep(POLL_INTERVAL)
+    return None
+
+def _update_session(data_dir, update):
+    """在文件锁保护下读取并修改当前会话的进行中查询列表"""
+    # translation_engine在模块级导入本模块，这里延迟导入避免循环
+    import translation_engine
+    session_file = os.path.join(get_inflight_dir(data_dir), "session.json")
+    translation_engine.update_json_file(session_file, lambda entries: update(entries if isinstance(entries, list) else []))
+
+def register_query(data_dir, key, pid=None):
+    """登记当前进程（或常驻进程代为登记的客户端进程pid）的查询，并取消会话中查询内容不同的旧进程
+
+    每次按键都会启动新进程，旧查询的结果Alfred已经不再需要，
+    终止这些进程可以断开它们的连接，减少无用的API消耗。
+    """
+    pid = pid or os.getpid()
+    superseded = []
+
+    def update(entries):
+        kept = []
+        for entry in entries:
+            if entry.get("pid") == pid or not _pid_alive(entry.get("pid", 0)):
+                continue
+            if entry.get("key") != key and time.time() - entry.get("time", 0) < LOCK_STALE_SECONDS:
+                superseded.append(entry["pid"])
+                continue
+            kept.append(entry)
+        kept.append({"pid": pid, "key": key, "time": time.time()})
+        return kept
+
+    try:
+        _update_session(data_dir, update)
+    except OSError:
+        return
+
+    for old_pid in superseded:
+        try:
+            os.kill(old_pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+def unregister_query(data_dir, pid=None):
+    """从会话中移除当前进程（或指定的pid）"""
+    pid = pid or os.getpid()
+    try:
+        _update_session(data_dir, lambda entries: [e for e in entries if e.get("pid") != pid])
+    except OSError:
+        pass
+
+def _handle_sigterm(signum, frame):
+    raise SystemExit(143)
+
+def exit_on_sigterm():
+    """收到SIGTERM时正常退出，使finally中的清理逻辑得以执行"""
+    signal.signal(signal.SIGTERM, _handle_sigterm)
\ No newline at end of file
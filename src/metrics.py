@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import math
+import time
+import threading
+
+# 日志超过该大小（字节）时轮换为metrics.jsonl.1
+MAX_LOG_BYTES = 5 * 1024 * 1024
+# 报告默认统计的天数
+REPORT_DAYS = 7
+
+# 模块导入时间，作为启动耗时的起点
+_imported = time.perf_counter()
+_lock = threading.Lock()
+# 当前进程正在记录的数据，未调用start()时各函数都不做任何事
+_current = None
+
+def get_metrics_file():
+    """获取性能日志路径"""
+    # translation_engine在模块级导入本模块，这里延迟导入避免循环
+    import translation_engine
+    return os.path.join(translation_engine.get_workflow_data_dir(), "metrics.jsonl")
+
+def is_enabled(config=None):
+    """是否开启了性能记录（配置metrics），未传入配置时由translation_engine加载"""
+    if config is None:
+        import translation_engine
+        config = translation_engine.load_config()
+    return bool(config.get("metrics"))
+
+def start(command, began=None):
+    """开始记录本次调用，启动耗时从began（time.perf_counter()的值）算起，默认为本模块导入时"""
+    global _current
+    now = time.perf_counter()
+    began = _imported if began is None else began
+    _current = {
+        "command": command,
+        "began": began,
+        "spans": {"startup": (now - began) * 1000},
+        "tags": {},
+        "usage": {}
+    }
+
+class span:
+    """记录代码块耗时（毫秒），同名多次调用时累加；用法：with metrics.span("gate"): ..."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_span(self.name, (time.perf_counter() - self.began) * 1000)
+
+def add_span(name, ms):
+    """累加一段耗时（毫秒）"""
+    if _current is None:
+        return
+    with _lock:
+        _current["spans"][name] = _current["spans"].get(name, 0) + ms
+
+def add_timings(timings):
+    """记录http_client的连接、TLS握手、首字节和总耗时"""
+    if _current is None or not timings:
+        return
+    for name in ("connect", "tls", "ttfb", "total"):
+        if timings.get(name) is not None:
+            add_span(f"net_{name}", timings[name] * 1000)
+    if timings.get("reused"):
+        tag("connection_reused", True)
+
+def add_usage(usage):
+    """累加API响应中的usage（token数）"""
+    if _current is None or not usage:
+        return
+    with _lock:
+        for name in ("prompt_tokens", "completion_tokens"):
+            if isinstance(usage.get(name), int):
+                _current["usage"][name] = _current["usage"].get(name, 0) + usage[name]
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if isinstance(cached, int):
+            _current["usage"]["cached_tokens"] = _current["usage"].get("cached_tokens", 0) + cached
+
+def tag(name, value):
+    """记录本次调用的属性（如outcome），已有同名属性时保留先记录的值"""
+    if _current is None:
+        return
+    with _lock:
+        _current["tags"].setdefault(name, value)
+
+def flush(config=None):
+    """把本次调用追加写入日志；未开启性能记录时丢弃"""
+    global _current
+    record, _current = _current, None
+    if record is None or not is_enabled(config):
+        return
+    entry = {
+        "ts": round(time.time(), 3),
+        "cmd": record["command"],
+        "ms": round((time.perf_counter() - record["began"]) * 1000, 2),
+        "spans": {name: round(ms, 2) for name, ms in record["spans"].items()}
+    }
+    entry.update(record["tags"])
+    if record["usage"]:
+        entry["usage"] = record["usage"]
+    line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n"
+    metrics_file = get_metrics_file()
+    try:
+        if os.path.getsize(metrics_file) > MAX_LOG_BYTES:
+            os.replace(metrics_file, metrics_file + ".1")
+    except OSError:
+        pass
+    try:
+        # 单行追加写入，多个进程同时写也不会交错
+        with open(metrics_file, 'a', encoding='utf-8') as f:
+            f.write(line)
+    except OSError:
+        pass
+
+def load_records(days=REPORT_DAYS):
+    """读取最近几天的日志记录"""
+    since = time.time() - days * 86400
+    records = []
+    metrics_file = get_metrics_file()
+    for path in (metrics_file + ".1", metrics_file):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("ts", 0) >= since:
+                        records.append(record)
+        except OSError:
+            pass
+    return records
+
+def percentile(values, p):
+    """取第p百分位数（最近秩法）"""
+    if not values:
+        return None
+    values = sorted(values)
+    # 秩为ceil(p/100*n)；不用round(x+0.5)：round()取偶舍入，p/100*n为奇数时会多取一位
+    index = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+def summarize(records):
+    """汇总记录：各命令及各阶段的p50/p95/p99耗时、缓存命中率、每天token用量"""
+    import datetime
+    summary = {"count": len(records), "commands": {}, "spans": {}, "outcomes": {}, "tokens_per_day": {}}
+    by_command = {}
+    by_span = {}
+    for record in records:
+        by_command.setdefault(record.get("cmd", "?"), []).append(record.get("ms", 0))
+        for name, ms in record.get("spans", {}).items():
+            by_span.setdefault(name, []).append(ms)
+        outcome = record.get("outcome")
+        if outcome:
+            summary["outcomes"][outcome] = summary["outcomes"].get(outcome, 0) + 1
+        usage = record.get("usage")
+        if usage:
+            day = datetime.date.fromtimestamp(record.get("ts", 0)).isoformat()
+            totals = summary["tokens_per_day"].setdefault(day, {"prompt_tokens": 0, "completion_tokens": 0})
+            for name in totals:
+                totals[name] += usage.get(name, 0)
+
+    for target, groups in ((summary["commands"], by_command), (summary["spans"], by_span)):
+        for name, values in groups.items():
+            target[name] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99)
+            }
+
+    outcomes = summary["outcomes"]
+    lookups = outcomes.get("cache", 0) + outcomes.get("api", 0)
+    summary["hit_rate"] = outcomes.get("cache", 0) / lookups if lookups else None
+    return summary
+
+def format_report(summary):
+    """把汇总结果格式化为文本"""
+    lines = [f"最近{REPORT_DAYS}天共 {summary['count']} 次调用"]
+    if summary["hit_rate"] is not None:
+        lines.append(f"缓存命中率: {summary['hit_rate'] * 100:.1f}%")
+    lines.append("")
+    lines.append("耗时(ms)      p50 / p95 / p99")
+    for title, group in (("命令", summary["commands"]), ("阶段", summary["spans"])):
+        for name, stats in sorted(group.items()):
+            lines.append(f"{title} {name}: {stats['p50']:.1f} / {stats['p95']:.1f} / {stats['p99']:.1f}（{stats['count']}次）")
+    if summary["tokens_per_day"]:
+        lines.append("")
+        lines.append("每天token用量（输入 / 输出）")
+        for day, totals in sorted(summary["tokens_per_day"].items()):
+            lines.append(f"{day}: {totals['prompt_tokens']} / {totals['completion_tokens']}")
+    return "\n".join(lines)
+
+def main():
+    print(format_report(summarize(load_records())))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import random
+import threading
+import email.utils
+
+# 令牌桶最多积攒多少秒的额度，避免空闲后瞬间打满配额
+BURST_SECONDS = 10
+
+_DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_duration(value):
+    """解析x-ratelimit-reset-*格式的时长（如 "1s"、"6m0s"、"20ms"），返回秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    matches = _DURATION_PATTERN.findall(value)
+    if not matches:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in matches)
+
+def parse_number(value):
+    """解析x-ratelimit-limit-*、x-ratelimit-remaining-*等数值响应头，无法解析时返回None"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def parse_retry_after(value):
+    """解析Retry-After头（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """带随机抖动的指数退避（full jitter）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class RateLimiter:
+    """按每分钟请求数(RPM)和token数(TPM)限流的令牌桶，可根据响应头自动收紧
+
+    未配置的额度按响应头x-ratelimit-limit-*（每分钟）自动建立，配置了的以配置为准。
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._configured = set()
+        for name, per_minute in (('requests', rpm), ('tokens', tpm)):
+            if per_minute:
+                self._set_limit(name, per_minute)
+                self._configured.add(name)
+        self._resume_at = 0.0
+
+    def _set_limit(self, name, per_minute):
+        """建立或调整每分钟额度为per_minute的令牌桶，调用时需持有锁（构造时除外）"""
+        now = time.monotonic()
+        rate = per_minute / 60.0
+        capacity = max(1.0, rate * BURST_SECONDS)
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            self._buckets[name] = {'rate': rate, 'capacity': capacity, 'level': capacity, 'updated': now}
+        elif bucket['rate'] != rate:
+            # 先按旧速率补充到现在，再换成新额度
+            self._refill(now)
+            bucket.update(rate=rate, capacity=capacity, level=min(bucket['level'], capacity))
+
+    def _refill(self, now):
+        for bucket in self._buckets.values():
+            bucket['level'] = min(bucket['capacity'], bucket['level'] + (now - bucket['updated']) * bucket['rate'])
+            bucket['updated'] = now
+
+    def acquire(self, tokens=0):
+        """阻塞直到允许发出一个估计消耗tokens的请求"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._resume_at - now
+                needs = {'requests': 1, 'tokens': tokens}
+                for name, bucket in self._buckets.items():
+                    # 单个请求超过桶容量时按满桶处理，避免永远等待
+                    need = min(needs[name], bucket['capacity'])
+                    if bucket['level'] < need:
+                        wait = max(wait, (need - bucket['level']) / bucket['rate'])
+                if wait <= 0:
+                    for name, bucket in self._buckets.items():
+                        bucket['level'] -= min(needs[name], bucket['capacity'])
+                    return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """所有请求暂停指定秒数（收到429或Retry-After时调用）"""
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """根据x-ratelimit-*和Retry-After响应头调整额度：按limit建立或调整未配置的令牌桶，按remaining收紧"""
+        if headers is None:
+            return
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after:
+            self.pause(retry_after)
+
+        for name in ('requests', 'tokens'):
+            limit = parse_number(headers.get(f'x-ratelimit-limit-{name}'))
+            remaining = parse_number(headers.get(f'x-ratelimit-remaining-{name}'))
+            with self._lock:
+                if limit and limit > 0 and name not in self._configured:
+                    self._set_limit(name, limit)
+                bucket = self._buckets.get(name)
+                if bucket is not None and remaining is not None:
+                    # 服务端剩余额度比本地估计少时以服务端为准
+                    bucket['level'] = min(bucket['level'], remaining)
+            if remaining is not None and remaining <= 0:
+                reset = parse_duration(headers.get(f'x-ratelimit-reset-{name}'))
+                if reset:
+                    self.pause(reset)
\ No newline at end of file
@@ -4,55 +4,27 @@
 import sys
 import json
 import os
-import urllib.request
+import time
 import urllib.parse
 import urllib.error
 import subprocess
+import http_client
+import translation_cache
+import metrics
+import translation_engine
 
-def get_workflow_data_dir():
-    """获取workflow数据目录"""
-    bundle_id = "com.translator.alfred"
-    data_dir = os.path.expanduser(f"~/Library/Application Support/Alfred/Workflow Data/{bundle_id}")
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    return data_dir
+# 模型列表缓存的有效期（秒），过期后先显示缓存的列表，同时在后台向接口确认是否有变化；可通过配置models_cache_ttl修改
+MODELS_CACHE_TTL = 86400
+# 接口返回的type字段中表示对话模型的取值
+CHAT_MODEL_TYPES = ("chat", "language", "code")
+# 非对话模型的名称特征，开启“仅显示对话模型”时过滤
+NON_CHAT_MARKERS = (
+    "embed", "whisper", "tts", "dall-e", "moderation", "davinci", "babbage",
+    "transcribe", "rerank", "realtime", "image", "sora"
+)
 
-def load_config():
-    """加载配置"""
-    config_file = os.path.join(get_workflow_data_dir(), "config.json")
-    default_config = {
-        "api_url": "https://api.openai.com/v1/chat/completions",
-        "api_key": "",
-        "model": "gpt-3.5-turbo",
-        "prompt": "请将以下中文翻译成自然、口语化的英文，适合在聊天、论坛等非正式场合使用。保持原意的同时，让表达更加地道和自然："
-    }
-    
-    if os.path.exists(config_file):
-        try:
-            with open(config_file, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                # 合并默认配置
-                for key, value in default_config.items():
-                    if key not in config:
-                        config[key] = value
-                return config
-        except:
-            pass
-    
-    return default_config
-
-def save_config(config):
-    """保存配置"""
-    config_file = os.path.join(get_workflow_data_dir(), "config.json")
-    with open(config_file, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
-
-def get_available_models(api_url, api_key):
-    """从API实时获取可用模型列表"""
-    if not api_key or not api_url:
-        return []
-    
-    # 构建models API URL
+def get_models_url(api_url):
+    """由对话接口地址得到模型列表地址"""
     # 从 domain.com/v1/chat/completions 提取 domain.com/v1
     if '/chat/completions' in api_url:
         base_url = api_url.replace('/chat/completions', '')
@@ -61,33 +33,74 @@ def get_available_models(api_url, api_key):
     else:
         # 如果URL不包含标准端点，假设它是基础URL
         base_url = api_url.rstrip('/')
-    
-    models_url = f"{base_url}/models"
-    
+    return f"{base_url}/models"
+
+def get_models_cache_file():
+    """获取模型列表缓存文件路径"""
+    return os.path.join(translation_engine.get_workflow_data_dir(), "models_cache.json")
+
+def get_models_cache_id(models_url, api_key):
+    """模型列表缓存的键：模型列表地址和API Key的摘要（不同Key可用的模型可能不同）"""
+    import hashlib
+    return f"{models_url}|{hashlib.md5(api_key.encode('utf-8')).hexdigest()[:8]}"
+
+def load_models_cache():
+    """读取模型列表缓存"""
+    try:
+        with open(get_models_cache_file(), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_models_entry(cache_id, entry):
+    """在文件锁保护下写入一条模型列表缓存，先写临时文件再改名替换"""
+    def update(cache):
+        cache = cache if isinstance(cache, dict) else {}
+        cache[cache_id] = entry
+        return cache
+
+    translation_engine.update_json_file(get_models_cache_file(), update)
+
+def is_chat_model(model):
+    """根据接口返回的type字段（部分网关提供）或模型名称判断是否为对话模型"""
+    model_type = str(model.get("type") or "").lower()
+    if model_type and model_type not in CHAT_MODEL_TYPES:
+        return False
+    name = model["id"].lower()
+    return not any(marker in name for marker in NON_CHAT_MARKERS)
+
+def fetch_models(models_url, api_key, cached=None):
+    """请求模型列表，返回新的缓存条目，失败时返回None
+
+    cached为已有的缓存条目时带上If-None-Match/If-Modified-Since，接口返回304（未变化）时沿用原列表。
+    """
     headers = {
         "Authorization": f"Bearer {api_key}",
         "User-Agent": "Colloquial-Translator/2.0",
         "Accept": "application/json"
     }
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
     
     try:
-        print(f"🔍 调试信息:")
-        print(f"   原始URL: {api_url}")
-        print(f"   基础URL: {base_url}")
-        print(f"   模型URL: {models_url}")
-        print(f"   API Key: {api_key[:8]}..." if len(api_key) > 8 else f"   API Key: {api_key}")
-        
-        req = urllib.request.Request(models_url, headers=headers)
-        with urllib.request.urlopen(req, timeout=15) as response:
+        with http_client.urlopen(models_url, headers=headers, timeout=15) as response:
+            if response.status == 304 and cached:
+                return dict(cached, fetched=time.time())
             result = json.loads(response.read().decode('utf-8'))
-            
-            if 'data' in result:
-                models = []
-                for model in result['data']:
-                    if 'id' in model:
-                        models.append(model['id'])
-                print(f"✅ 成功获取到 {len(models)} 个模型")
-                return sorted(models)
+            if 'data' not in result:
+                return None
+            models = [model for model in result['data'] if isinstance(model, dict) and 'id' in model]
+            print(f"✅ 成功获取到 {len(models)} 个模型")
+            return {
+                "models": sorted(model['id'] for model in models),
+                "chat_models": sorted(model['id'] for model in models if is_chat_model(model)),
+                "etag": response.getheader('ETag'),
+                "last_modified": response.getheader('Last-Modified'),
+                "fetched": time.time()
+            }
     except urllib.error.HTTPError as e:
         error_msg = e.read().decode('utf-8')
         print(f"❌ HTTP错误 {e.code}: {e.reason}")
@@ -101,52 +114,55 @@ def get_available_models(api_url, api_key):
     except Exception as e:
         print(f"❌ 获取模型列表失败: {e}")
     
-    return []
+    return None
+
+def refresh_models(models_url, api_key, cache_id, cached):
+    """在后台线程中重新验证模型列表缓存，用户在对话框中选择时即可完成，下次打开时生效"""
+    import threading
+    
+    def refresh():
+        entry = fetch_models(models_url, api_key, cached)
+        if entry is not None:
+            save_models_entry(cache_id, entry)
+    
+    # 非守护线程：对话框关闭后进程会等刷新完成再退出
+    threading.Thread(target=refresh).start()
+
+def get_available_models(api_url, api_key, config=None):
+    """获取可用模型列表：有缓存时立即返回，缓存过期时同时在后台刷新；没有缓存时从API获取
+
+    配置了models_chat_only时只返回对话模型（全部被过滤时仍返回完整列表），选择列表更短。
+    """
+    if not api_key or not api_url:
+        return []
+    config = config or {}
+    
+    models_url = get_models_url(api_url)
+    cache_id = get_models_cache_id(models_url, api_key)
+    cached = load_models_cache().get(cache_id)
+    if cached is None:
+        show_notification("获取模型", "正在从API获取可用模型列表...")
+        cached = fetch_models(models_url, api_key)
+        if cached is None:
+            return []
+        save_models_entry(cache_id, cached)
+    elif time.time() - cached.get("fetched", 0) > float(config.get("models_cache_ttl", MODELS_CACHE_TTL)):
+        refresh_models(models_url, api_key, cache_id, cached)
+    
+    if config.get("models_chat_only") and cached.get("chat_models"):
+        return cached["chat_models"]
+    return cached["models"]
 
 def test_api_connection(api_url, api_key, model):
-    """测试API连接"""
+    """测试API连接：用翻译时相同的请求发送一句短文本"""
     if not api_key or not api_url or not model:
         return False, "配置信息不完整"
     
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}",
-        "User-Agent": "Colloquial-Translator/2.0",
-        "Accept": "application/json"
-    }
-    
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "user", "content": "Hello"}
-        ],
-        "max_tokens": 5
-    }
-    
-    try:
-        req = urllib.request.Request(
-            api_url,
-            data=json.dumps(data).encode('utf-8'),
-            headers=headers
-        )
-        
-        with urllib.request.urlopen(req, timeout=15) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            if 'choices' in result:
-                return True, "连接成功"
-            else:
-                return False, "API返回格式错误"
-    except urllib.error.HTTPError as e:
-        error_msg = e.read().decode('utf-8')
-        try:
-            error_data = json.loads(error_msg)
-            if 'error' in error_data:
-                return False, f"API错误: {error_data['error'].get('message', '未知错误')}"
-        except:
-            pass
-        return False, f"HTTP错误: {e.code} {e.reason}"
-    except Exception as e:
-        return False, f"连接错误: {str(e)}"
+    config = dict(translation_engine.load_config(), api_url=api_url, api_key=api_key, model=model)
+    result = translation_engine.fetch_completion(*translation_engine.build_request("你好", config, max_tokens=5))
+    if not translation_engine.is_ok(result):
+        return False, result["text"]
+    return True, "连接成功"
 
 def show_dialog(title, message, default_answer=""):
     """显示输入对话框"""
@@ -189,9 +205,82 @@ def show_notification(title, text):
     '''
     subprocess.run(["osascript", "-e", script])
 
+# 可在"性能选项"中开关的配置项
+PERFORMANCE_OPTIONS = [
+    ("use_daemon", "后台常驻进程"),
+    ("stream", "流式翻译"),
+    ("speculative", "输入时预翻译"),
+    ("fuzzy_cache", "相似缓存"),
+    ("compact_prompt", "精简提示词"),
+    ("prompt_cache", "服务端提示词缓存"),
+    ("hedge_requests", "对冲请求"),
+    ("warmup", "预热连接"),
+    ("models_chat_only", "仅显示对话模型"),
+    ("metrics", "性能记录"),
+]
+
+def performance_settings(config):
+    """开关性能相关选项"""
+    choices = [
+        f"{label}: {'已开启' if config.get(key) else '已关闭'}"
+        for key, label in PERFORMANCE_OPTIONS
+    ]
+    choice = show_choice_dialog("性能选项", "选择要开启或关闭的选项:", choices)
+    if not choice:
+        return
+    
+    for key, label in PERFORMANCE_OPTIONS:
+        if choice.startswith(f"{label}:"):
+            config[key] = not config.get(key)
+            translation_engine.save_config(config, [key])
+            show_notification("设置成功", f"{label}已{'开启' if config[key] else '关闭'}")
+            return
+
+def show_cache_stats(config):
+    """显示翻译缓存的命中、淘汰统计"""
+    try:
+        stats = translation_cache.cache_stats(translation_cache.open_cache(translation_engine.get_workflow_data_dir()))
+    except Exception as e:
+        show_notification("错误", f"无法读取缓存: {e}")
+        return
+    
+    settings = translation_cache.get_cache_settings(config)
+    stats_text = f"""缓存统计:
+
+条目数: {stats['entries']} / {settings['max_entries'] or '不限'}
+占用: {stats['bytes'] / 1024:.1f} KB
+命中率: {stats['hit_rate'] * 100:.1f}% (未规范化 {stats['raw_hit_rate'] * 100:.1f}%)
+命中: {stats.get('hits', 0) + stats.get('memory_hits', 0)} (其中内存 {stats.get('memory_hits', 0)})
+未命中: {stats.get('misses', 0)}
+容量淘汰: {stats.get('evictions', 0)}
+过期清理: {stats.get('expired', 0)}
+有效期: {settings['ttl'] / 3600:g} 小时 | 淘汰策略: {settings['eviction'].upper()}"""
+    
+    script = f'''
+    display dialog "{stats_text}" with title "缓存统计" buttons {{"确定"}} default button "确定"
+    '''
+    subprocess.run(["osascript", "-e", script])
+
+def show_metrics_report(config):
+    """显示性能记录的汇总报告"""
+    if not config.get("metrics"):
+        show_notification("提示", "请先在 高级设置 → 性能选项 中开启性能记录")
+        return
+    
+    records = metrics.load_records()
+    if not records:
+        show_notification("提示", "暂无性能记录")
+        return
+    
+    report = metrics.format_report(metrics.summarize(records))
+    script = f'''
+    display dialog "{report}" with title "性能统计" buttons {{"确定"}} default button "确定"
+    '''
+    subprocess.run(["osascript", "-e", script])
+
 def setup_form():
     """一次性表单式设置"""
-    config = load_config()
+    config = translation_engine.load_config()
     
     # 步骤1: 设置API URL
     api_url = show_dialog("步骤1/4: 设置API URL", 
@@ -208,8 +297,7 @@ def setup_form():
         return
     
     # 步骤3: 获取并选择模型
-    show_notification("获取模型", "正在从API获取可用模型列表...")
-    models = get_available_models(api_url, api_key)
+    models = get_available_models(api_url, api_key, config)
     
     if not models:
         show_notification("警告", "无法获取模型列表，请手动输入模型名称")
@@ -231,14 +319,14 @@ def setup_form():
     if not prompt:
         prompt = config.get("prompt", "请将以下中文翻译成自然、口语化的英文，适合在聊天、论坛等非正式场合使用。保持原意的同时，让表达更加地道和自然：")
     
-    # 保存配置
-    new_config = {
+    # 保存配置（保留性能选项等其他设置）
+    config.update({
         "api_url": api_url,
         "api_key": api_key,
         "model": model,
         "prompt": prompt
-    }
-    save_config(new_config)
+    })
+    translation_engine.save_config(config, ["api_url", "api_key", "model", "prompt"])
     
     # 测试连接
     show_notification("测试连接", "正在测试API连接...")
@@ -250,13 +338,15 @@ def setup_form():
         show_notification("设置完成", f"⚠️ 配置已保存，但连接测试失败: {message}")
 
 def main():
-    config = load_config()
+    config = translation_engine.load_config()
     
     # 显示主菜单
     menu_choices = [
         "快速设置 (推荐)",
         "查看当前配置",
         "测试API连接",
+        "缓存统计",
+        "性能统计",
         "高级设置"
     ]
     
@@ -281,6 +371,12 @@ API Key: {'已设置 (' + config.get('api_key', '')[:8] + '...)' if config.get('
         '''
         subprocess.run(["osascript", "-e", script])
     
+    elif choice == "缓存统计":
+        show_cache_stats(config)
+    
+    elif choice == "性能统计":
+        show_metrics_report(config)
+    
     elif choice == "测试API连接":
         if not config.get("api_key") or not config.get("api_url") or not config.get("model"):
             show_notification("错误", "请先完成配置设置")
@@ -300,7 +396,8 @@ API Key: {'已设置 (' + config.get('api_key', '')[:8] + '...)' if config.get('
             "修改API URL",
             "修改API Key", 
             "重新选择模型",
-            "修改翻译提示词"
+            "修改翻译提示词",
+            "性能选项"
         ]
         
         advanced_choice = show_choice_dialog("高级设置", "请选择要修改的项目:", advanced_choices)
@@ -309,14 +406,14 @@ API Key: {'已设置 (' + config.get('api_key', '')[:8] + '...)' if config.get('
             new_url = show_dialog("修改API URL", "请输入新的API URL:", config.get("api_url", ""))
             if new_url:
                 config["api_url"] = new_url
-                save_config(config)
+                translation_engine.save_config(config, ["api_url"])
                 show_notification("设置成功", "API URL已更新")
         
         elif advanced_choice == "修改API Key":
             new_key = show_dialog("修改API Key", "请输入新的API Key:", config.get("api_key", ""))
             if new_key:
                 config["api_key"] = new_key
-                save_config(config)
+                translation_engine.save_config(config, ["api_key"])
                 show_notification("设置成功", "API Key已更新")
         
         elif advanced_choice == "重新选择模型":
@@ -324,14 +421,13 @@ API Key: {'已设置 (' + config.get('api_key', '')[:8] + '...)' if config.get('
                 show_notification("错误", "请先设置API URL和API Key")
                 return
             
-            show_notification("获取模型", "正在获取可用模型列表...")
-            models = get_available_models(config.get("api_url"), config.get("api_key"))
+            models = get_available_models(config.get("api_url"), config.get("api_key"), config)
             
             if models:
                 selected_model = show_choice_dialog("选择模型", f"从API获取到 {len(models)} 个可用模型:", models)
                 if selected_model:
                     config["model"] = selected_model
-                    save_config(config)
+                    translation_engine.save_config(config, ["model"])
                     show_notification("设置成功", f"已选择模型: {selected_model}")
             else:
                 show_notification("错误", "无法获取模型列表，请检查API配置")
@@ -340,8 +436,11 @@ API Key: {'已设置 (' + config.get('api_key', '')[:8] + '...)' if config.get('
             new_prompt = show_dialog("修改翻译提示词", "请输入新的翻译提示词:", config.get("prompt", ""))
             if new_prompt:
                 config["prompt"] = new_prompt
-                save_config(config)
+                translation_engine.save_config(config, ["prompt"])
                 show_notification("设置成功", "翻译提示词已更新")
+        
+        elif advanced_choice == "性能选项":
+            performance_settings(config)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+import hashlib
+
+# 特征为单字加字符二元组：单字容忍改写，二元组保留语序
+NGRAM_SIZE = 2
+# MinHash签名长度，分成BANDS段做局部敏感哈希（LSH），每段ROWS个值
+NUM_PERM = 32
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# 每次查询最多比较的候选条数
+MAX_CANDIDATES = 50
+# 默认相似度阈值（特征集合的Jaccard相似度）
+DEFAULT_THRESHOLD = 0.5
+
+_PRIME = (1 << 61) - 1
+# 固定随机种子，保证不同进程生成的签名一致
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+# 已建好索引表的连接（按id记录，连接在进程内一直复用）
+_schema_ready = set()
+
+def create_schema(conn):
+    """创建相似度索引表；翻译缓存条目被删除时同步删除索引"""
+    if id(conn) in _schema_ready:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS similarity_bands (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (band, bucket, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_similarity_key ON similarity_bands(key)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS similarity_cleanup AFTER DELETE ON translations
+        BEGIN
+            DELETE FROM similarity_bands WHERE key = old.key;
+        END
+    """)
+    _schema_ready.add(id(conn))
+
+def get_ngrams(text):
+    """切分为单字和字符n元组（忽略空白）"""
+    text = "".join(text.split())
+    ngrams = set(text)
+    ngrams.update(text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1))
+    return ngrams
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def minhash(ngrams):
+    """计算MinHash签名"""
+    hashes = [_hash64(ngram) for ngram in ngrams]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def get_buckets(signature, scope):
+    """把签名按段哈希为桶编号；scope区分模型和提示词，不同配置的译文互不匹配"""
+    buckets = []
+    for band in range(BANDS):
+        values = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(f"{scope}|{values}".encode('utf-8'), digest_size=8).digest()
+        # SQLite整数为有符号64位
+        buckets.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return buckets
+
+def jaccard(a, b):
+    """两个集合的Jaccard相似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def add_entry(conn, key, text, scope):
+    """为缓存条目建立相似度索引，text应为规范化后的原文"""
+    ngrams = get_ngrams(text)
+    if not ngrams:
+        return
+    create_schema(conn)
+    rows = [(band, bucket, key) for band, bucket in get_buckets(minhash(ngrams), scope)]
+    conn.executemany("INSERT OR IGNORE INTO similarity_bands (band, bucket, key) VALUES (?, ?, ?)", rows)
+
+def find_similar(conn, text, scope, min_timestamp, threshold=DEFAULT_THRESHOLD, normalize=None, exclude_key=None):
+    """查找原文与text最相似的未过期缓存，返回(相似度, 原文, 译文)，没有达到阈值的返回None
+
+    只比较与text至少有一段签名相同的候选条目，相同段数越多越优先，查询次数与缓存大小无关。
+    """
+    ngrams = get_ngrams(text)
+    if not ngrams:
+        return None
+    create_schema(conn)
+    buckets = get_buckets(minhash(ngrams), scope)
+    condition = " OR ".join(["(band = ? AND bucket = ?)"] * len(buckets))
+    params = [value for bucket in buckets for value in bucket]
+    rows = conn.execute(
+        f"""
+        SELECT t.key, t.source, t.translation FROM translations t
+        JOIN (
+            SELECT key, COUNT(*) AS matches FROM similarity_bands
+            WHERE {condition}
+            GROUP BY key ORDER BY matches DESC LIMIT ?
+        ) c ON c.key = t.key
+        WHERE t.timestamp >= ? AND t.source IS NOT NULL
+        """,
+        params + [MAX_CANDIDATES, min_timestamp]
+    ).fetchall()
+
+    best = None
+    for key, source, translation in rows:
+        if key == exclude_key:
+            continue
+        score = jaccard(ngrams, get_ngrams(normalize(source) if normalize else source))
+        if score >= threshold and (best is None or score > best[0]):
+            best = (score, source, translation)
+    return best
\ No newline at end of file
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import argparse
+import urllib.error
+import concurrent.futures
+import http_client
+import rate_limit
+import translation_engine
+
+# 每个批量请求的输入token预算
+DEFAULT_TOKEN_BUDGET = 2000
+# 单个批量请求最多包含的段落数
+MAX_SEGMENTS_PER_REQUEST = 50
+# 单个请求允许的最大输出token数
+MAX_OUTPUT_TOKENS = 4096
+# 默认并发请求数
+DEFAULT_CONCURRENCY = 4
+# 遇到429/5xx或网络错误时的最大重试次数
+MAX_RETRIES = 5
+
+BATCH_INSTRUCTION = (
+    "下面的JSON对象包含多段需要翻译的中文，键为段落编号，值为原文。"
+    "请按照要求逐段翻译，并以相同编号为键、译文为值返回一个JSON对象，"
+    "不要合并或拆分段落，不要输出JSON以外的任何内容：\n"
+)
+
+def read_lines(path):
+    """从文件或标准输入读取待翻译的行"""
+    if path and path != '-':
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+    return sys.stdin.read().splitlines()
+
+def pack_segments(segments, token_budget):
+    """按token预算把(编号, 原文)打包成多个批次"""
+    batches = []
+    current = []
+    current_tokens = 0
+    for segment_id, text in segments:
+        tokens = translation_engine.estimate_tokens(text)
+        if current and (current_tokens + tokens > token_budget or len(current) >= MAX_SEGMENTS_PER_REQUEST):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append((segment_id, text))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_batch_response(content):
+    """解析模型返回的JSON对象，兼容代码块包裹"""
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip('`')
+        if content.startswith("json"):
+            content = content[4:]
+    start = content.find('{')
+    end = content.rfind('}')
+    if start < 0 or end < start:
+        return {}
+    try:
+        result = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+    return {str(key): str(value).strip() for key, value in result.items() if isinstance(value, str)}
+
+def send_with_retry(url, body, headers, limiter, tokens):
+    """发送请求，429/5xx和网络错误按Retry-After或指数退避重试，返回(内容, 错误信息)"""
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire(tokens)
+        try:
+            with http_client.urlopen(url, data=body, headers=headers, timeout=30) as response:
+                limiter.update_from_headers(response.headers)
+                result = json.loads(response.read().decode('utf-8'))
+                if 'choices' in result and len(result['choices']) > 0:
+                    return result['choices'][0]['message']['content'].strip(), None
+                return None, "翻译失败：API返回格式错误"
+        except urllib.error.HTTPError as e:
+            limiter.update_from_headers(e.headers)
+            if (e.code == 429 or e.code >= 500) and attempt < MAX_RETRIES:
+                delay = rate_limit.parse_retry_after(e.headers.get('Retry-After'))
+                limiter.pause(delay if delay is not None else rate_limit.backoff_delay(attempt))
+                continue
+            return None, translation_engine.describe_error(e)["text"]
+        except urllib.error.URLError as e:
+            if attempt < MAX_RETRIES:
+                time.sleep(rate_limit.backoff_delay(attempt))
+                continue
+            return None, translation_engine.describe_error(e)["text"]
+        except Exception as e:
+            return None, translation_engine.describe_error(e)["text"]
+    return None, "翻译失败：重试次数过多"
+
+def translate_batch(batch, config, limiter):
+    """把一个批次合并为一次API调用，返回{编号: 译文}和错误信息"""
+    payload = json.dumps({str(segment_id): text for segment_id, text in batch}, ensure_ascii=False)
+    input_tokens = sum(translation_engine.estimate_tokens(text) for _, text in batch)
+    output_tokens = min(MAX_OUTPUT_TOKENS, input_tokens * 2 + 20 * len(batch))
+    url, body, headers = translation_engine.build_request(
+        BATCH_INSTRUCTION + payload,
+        config,
+        max_tokens=output_tokens
+    )
+    content, error = send_with_retry(url, body, headers, limiter, input_tokens + output_tokens)
+    if error:
+        return {}, error
+    return parse_batch_response(content), None
+
+def translate_segment(text, config, limiter):
+    """单独翻译一段（批量结果中缺失的段落），与批量请求共用限流和重试，失败时返回None"""
+    input_tokens = translation_engine.estimate_tokens(text)
+    output_tokens = min(MAX_OUTPUT_TOKENS, input_tokens * 2 + 20)
+    url, body, headers = translation_engine.build_request(text, config, max_tokens=output_tokens)
+    content, error = send_with_retry(url, body, headers, limiter, input_tokens + output_tokens)
+    if error or not content:
+        return None
+    translation_engine.store_cache(text, config, content)
+    return content
+
+def run_batch(lines, config, token_budget=DEFAULT_TOKEN_BUDGET, concurrency=DEFAULT_CONCURRENCY, limiter=None, log=None):
+    """批量翻译，返回与输入逐行对应的译文列表和统计信息"""
+    started = time.time()
+    stats = {"lines": 0, "cache_hits": 0, "requests": 0, "fallbacks": 0, "errors": 0}
+    results = [""] * len(lines)
+
+    # 先查缓存，相同原文只翻译一次
+    pending = {}
+    for index, line in enumerate(lines):
+        text = line.strip()
+        if not text:
+            continue
+        stats["lines"] += 1
+        cached = translation_engine.lookup_cache(text, config)
+        if cached is not None:
+            stats["cache_hits"] += 1
+            results[index] = cached
+        else:
+            pending.setdefault(text, []).append(index)
+
+    # 以首次出现的行号作为稳定的段落编号
+    segments = [(indexes[0] + 1, text) for text, indexes in pending.items()]
+    batches = pack_segments(segments, token_budget)
+    stats["requests"] = len(batches)
+    limiter = limiter or rate_limit.RateLimiter()
+
+    def process(batch):
+        translations, error = translate_batch(batch, config, limiter)
+        if error:
+            # 整批失败（鉴权等）时逐条重试大概率同样失败，留空并继续
+            return batch, {}, error, 0
+        fallbacks = 0
+        for segment_id, text in batch:
+            translated = translations.get(str(segment_id))
+            if translated:
+                translation_engine.store_cache(text, config, translated)
+            else:
+                # 模型漏掉的段落逐条重试，同样经过限流，仍失败时不计入译文
+                fallbacks += 1
+                translated = translate_segment(text, config, limiter)
+                if translated:
+                    translations[str(segment_id)] = translated
+        return batch, translations, None, fallbacks
+
+    completed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for batch, translations, error, fallbacks in executor.map(process, batches):
+            completed += 1
+            # 每完成一批写入一次缓存，中途退出时已完成的批次不会丢失
+            translation_engine.run_deferred()
+            stats["fallbacks"] += fallbacks
+            if error:
+                stats["errors"] += len(batch)
+                if log:
+                    log(f"批量请求失败：{error}")
+                continue
+            for segment_id, text in batch:
+                translated = translations.get(str(segment_id))
+                if translated is None:
+                    stats["errors"] += 1
+                    continue
+                for index in pending[text]:
+                    results[index] = translated
+            if log:
+                log(f"已完成 {completed}/{len(batches)} 个批次")
+
+    stats["elapsed"] = time.time() - started
+    return results, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="批量翻译文件或标准输入中的每一行")
+    parser.add_argument("input", nargs="?", default="-", help="输入文件，默认读取标准输入")
+    parser.add_argument("-o", "--output", help="输出文件，默认写到标准输出")
+    parser.add_argument("--budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="每个请求的输入token预算")
+    parser.add_argument("-j", "--workers", type=int, help=f"并发请求数，默认读取配置batch_concurrency或{DEFAULT_CONCURRENCY}")
+    parser.add_argument("--rpm", type=int, help="每分钟请求数上限，默认读取配置rate_limit_rpm")
+    parser.add_argument("--tpm", type=int, help="每分钟token数上限，默认读取配置rate_limit_tpm")
+    args = parser.parse_args()
+
+    config = translation_engine.load_config()
+    if not config.get("api_key"):
+        print("错误：请先配置API Key（使用 tset 命令）", file=sys.stderr)
+        sys.exit(1)
+
+    log = lambda message: print(message, file=sys.stderr)
+    limiter = rate_limit.RateLimiter(
+        rpm=args.rpm or config.get("rate_limit_rpm"),
+        tpm=args.tpm or config.get("rate_limit_tpm")
+    )
+    concurrency = args.workers or config.get("batch_concurrency") or DEFAULT_CONCURRENCY
+    results, stats = run_batch(read_lines(args.input), config, args.budget, concurrency, limiter, log)
+
+    # 保持逐行对应，译文中的换行替换为空格
+    output = "\n".join(line.replace("\n", " ") for line in results) + "\n"
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+
+    rate = stats["lines"] / stats["elapsed"] if stats["elapsed"] > 0 else 0
+    log(
+        f"共 {stats['lines']} 行，缓存命中 {stats['cache_hits']} 行，"
+        f"API请求 {stats['requests']} 次，逐条重试 {stats['fallbacks']} 行，失败 {stats['errors']} 行，"
+        f"耗时 {stats['elapsed']:.1f} 秒（{rate:.1f} 行/秒）"
+    )
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
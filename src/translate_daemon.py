@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+
+# 空闲多久后自动退出（秒）
+IDLE_TIMEOUT = 600
+# 客户端等待常驻进程返回的最长时间，需覆盖一次完整的API调用
+CLIENT_TIMEOUT = 35
+# 请求预热时等待常驻进程确认的最长时间（秒），预热本身在响应之后进行
+WARMUP_TIMEOUT = 1
+# macOS的Unix socket路径上限为104字节（含结尾的0）
+MAX_SOCKET_PATH = 103
+# 处理请求的线程数：线程在请求间复用，各线程的缓存数据库连接也随之复用
+DAEMON_WORKERS = 8
+# 连续输入时，未命中缓存的查询先等待多久再请求（秒），期间被后续按键取代则不发请求
+QUERY_DEBOUNCE = 0.1
+# 距上一次查询不到该时间（秒）视为正在连续输入；单独的查询（粘贴、停顿后的输入）不等待
+TYPING_INTERVAL = 1.0
+
+def get_runtime_dir():
+    """获取socket和锁文件所在目录：用户私有临时目录（$TMPDIR）下按用户区分的子目录
+
+    workflow数据目录太长，超过socket路径上限；$TMPDIR也过长时退回/tmp，此时靠目录权限检查防止他人抢占。
+    """
+    name = f"com.translator.alfred-{os.getuid()}"
+    path = os.path.join(os.environ.get("TMPDIR") or "/tmp", name)
+    if len(os.path.join(path, "daemon.sock")) > MAX_SOCKET_PATH:
+        path = os.path.join("/tmp", name)
+    return path
+
+def get_socket_path():
+    """获取Unix socket路径"""
+    return os.path.join(get_runtime_dir(), "daemon.sock")
+
+def get_lock_path():
+    """获取常驻进程锁文件路径"""
+    return os.path.join(get_runtime_dir(), "daemon.lock")
+
+def is_owned(path):
+    """文件属于当前用户且不是符号链接"""
+    import stat
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return info.st_uid == os.getuid() and not stat.S_ISLNK(info.st_mode)
+
+def ensure_runtime_dir():
+    """创建运行目录，确认它属于当前用户且他人无权访问；被他人抢占时返回False"""
+    path = get_runtime_dir()
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return False
+    if not is_owned(path):
+        return False
+    return os.lstat(path).st_mode & 0o077 == 0
+
+def forward_query(argv):
+    """Script Filter的快速路径：把查询交给常驻进程，输出结果并结束标准输出，返回耗时（毫秒）
+
+    输入为空或常驻进程不可用时返回None，由Script Filter自己处理。只用到标准库，在加载引擎模块之前调用。
+    """
+    text = argv[1].strip() if len(argv) > 1 else ""
+    if not text:
+        return None
+    import time
+    started = time.perf_counter()
+    output = query_daemon(text)
+    if output is None:
+        return None
+    elapsed = (time.perf_counter() - started) * 1000
+    try:
+        sys.stdout.write(output + "\n")
+        sys.stdout.flush()
+        # 与translation_engine.end_output()相同：Alfred读到EOF即显示结果，之后再导入模块、记录耗时
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.close(devnull)
+    except (OSError, ValueError):
+        pass
+    return elapsed
+
+def query_daemon(text, timeout=CLIENT_TIMEOUT):
+    """把查询发给常驻进程，返回Alfred结果JSON；常驻进程不可用时返回None
+
+    附带客户端pid，由常驻进程在开始处理前代为登记到inflight会话：客户端无需加载引擎模块，
+    后续按键的查询照常终止本客户端，常驻进程同时取消本查询的请求。
+    """
+    return send_request(f"query {os.getpid()}\n{text}", timeout)
+
+def warm_daemon():
+    """请常驻进程预先建立连接，常驻进程不可用时返回False"""
+    return send_request("warmup\n", WARMUP_TIMEOUT) is not None
+
+def send_request(request, timeout):
+    """向常驻进程发送一个请求并读取完整响应，常驻进程不可用时返回None
+
+    请求首行为命令（query <客户端pid>或warmup），其余部分为查询原文，客户端无需加载json（及其依赖的re）。
+    """
+    socket_path = get_socket_path()
+    # 只连接当前用户私有目录中、由当前用户创建的socket，避免把原文发给他人伪造的服务
+    if not is_owned(socket_path) or not ensure_runtime_dir():
+        return None
+
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(request.encode('utf-8'))
+            sock.shutdown(socket.SHUT_WR)
+
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError:
+        return None
+
+    output = b"".join(chunks).decode('utf-8')
+    return output or None
+
+def start_daemon():
+    """在后台启动常驻进程"""
+    import subprocess
+    script = os.path.abspath(__file__)
+    try:
+        subprocess.Popen(
+            [sys.executable, script],
+            cwd=os.path.dirname(script),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+    except OSError:
+        pass
+
+def serve():
+    """运行常驻进程，保持配置、缓存和网络连接常驻内存"""
+    import fcntl
+    import json
+    import socket
+    import concurrent.futures
+    import socketserver
+    import threading
+    import time
+    import http_client
+    import inflight
+    import translate_filter_v2
+    import translation_engine
+
+    # socket和锁文件只允许当前用户访问，避免他人借用API Key
+    os.umask(0o077)
+    if not ensure_runtime_dir():
+        return
+
+    # 同一时间只允许一个常驻进程
+    try:
+        lock_file = open(get_lock_path(), 'w')
+    except OSError:
+        return
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return
+
+    config_file = os.path.join(translation_engine.get_workflow_data_dir(), "config.json")
+    state = {
+        "config": None,
+        "config_mtime": None,
+        "last_active": time.time(),
+        "last_query": 0.0
+    }
+    state_lock = threading.Lock()
+    # 正在处理的查询：CancelToken -> (缓存键, 被取代时置位的Event)
+    active = {}
+    active_lock = threading.Lock()
+
+    def get_config():
+        """配置文件有修改时才重新加载"""
+        try:
+            mtime = os.path.getmtime(config_file)
+        except OSError:
+            mtime = None
+        with state_lock:
+            if state["config"] is None or mtime != state["config_mtime"]:
+                state["config"] = translation_engine.load_config()
+                state["config_mtime"] = mtime
+            return state["config"]
+
+    def begin_query(key):
+        """登记查询，取消其他缓存键不同的查询（已被后续按键取代）
+
+        返回本查询的CancelToken、被取代时置位的Event，以及是否正在连续输入。
+        """
+        token = http_client.CancelToken()
+        superseded = threading.Event()
+        with active_lock:
+            now = time.time()
+            typing = now - state["last_query"] < TYPING_INTERVAL
+            state["last_query"] = now
+            for other, (other_key, other_superseded) in active.items():
+                if other_key != key:
+                    other_superseded.set()
+                    other.cancel()
+            active[token] = (key, superseded)
+        return token, superseded, typing
+
+    def end_query(token):
+        with active_lock:
+            active.pop(token, None)
+
+    def answer(text, client_pid):
+        """处理一次查询；被后续按键取代时返回空结果（客户端此时已被终止）"""
+        config = get_config()
+        data_dir = translation_engine.get_workflow_data_dir()
+        verdict = translate_filter_v2.classify_input(text)
+        key = translate_filter_v2.get_query_key(text, config, verdict)
+        token, superseded, typing = begin_query(key)
+        if client_pid:
+            inflight.register_query(data_dir, key, pid=client_pid)
+        try:
+            if (typing and verdict["translate"] and config.get("api_key")
+                    and translation_engine.lookup_cache(text, config, record=False) is None
+                    and superseded.wait(QUERY_DEBOUNCE)):
+                return {"items": []}
+            with translation_engine.query_cancel(token):
+                return translate_filter_v2.build_result(text, config, verdict)
+        finally:
+            end_query(token)
+            if client_pid:
+                inflight.unregister_query(data_dir, pid=client_pid)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            state["last_active"] = time.time()
+            command = []
+            try:
+                command = self.rfile.readline().decode('utf-8').split()
+                if command == ["warmup"]:
+                    result = {"warmup": True}
+                else:
+                    result = answer(self.rfile.read().decode('utf-8'), int(command[1]))
+            except Exception as e:
+                result = {
+                    "items": [
+                        {
+                            "uid": "error",
+                            "title": "翻译失败",
+                            "subtitle": f"翻译失败：{str(e)}",
+                            "arg": "",
+                            "valid": False
+                        }
+                    ]
+                }
+            # 先结束响应让客户端返回，再写缓存；客户端可能已被后续按键终止
+            try:
+                self.wfile.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+                self.request.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            if command == ["warmup"]:
+                translation_engine.warm_up(get_config())
+            translation_engine.run_deferred()
+            state["last_active"] = time.time()
+
+    socket_path = get_socket_path()
+    if os.path.lexists(socket_path):
+        # 持有锁说明旧socket已无人监听
+        os.unlink(socket_path)
+
+    # 每个请求新建线程时，线程内的缓存数据库连接（translation_cache按线程复用）每次都要重新打开
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=DAEMON_WORKERS)
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        def process_request(self, request, client_address):
+            pool.submit(self.process_request_thread, request, client_address)
+
+    server = Server(socket_path, Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    if get_config().get("warmup"):
+        # 启动时即预热，第一次翻译无需再建连
+        threading.Thread(target=translation_engine.warm_up, args=(get_config(),), daemon=True).start()
+
+    try:
+        while True:
+            time.sleep(5)
+            # 空闲超时或在设置中关闭后退出
+            if time.time() - state["last_active"] > IDLE_TIMEOUT:
+                break
+            if not get_config().get("use_daemon"):
+                break
+    finally:
+        server.shutdown()
+        server.server_close()
+        pool.shutdown(wait=False)
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+        lock_file.close()
+
+if __name__ == "__main__":
+    serve()
\ No newline at end of file
@@ -2,250 +2,167 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import time
+import translate_daemon
+
+# 常驻进程在运行时直接交给它处理并结束输出，之后才加载引擎模块（metrics、translation_engine、inflight），
+# 缓存命中等常驻进程能很快返回的查询不必等待导入；结果在main()中记录
+_started = time.perf_counter()
+_daemon_ms = translate_daemon.forward_query(sys.argv) if __name__ == "__main__" else None
+
 import json
 import os
-import urllib.request
-import urllib.parse
-import urllib.error
-import subprocess
-import time
-import hashlib
+import re
+import metrics
+import translation_engine
+import inflight
 
-def get_workflow_data_dir():
-    """获取workflow数据目录"""
-    bundle_id = "com.translator.alfred"
-    data_dir = os.path.expanduser(f"~/Library/Application Support/Alfred/Workflow Data/{bundle_id}")
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    return data_dir
+# 每次按键都会启动新进程，网络（http_client会加载ssl、http.client）、缓存（sqlite3）、子进程、线程池等
+# 较重的模块只在真正需要时于函数内导入，空输入、输入中等路径无需加载，缓存命中时也不会加载网络模块
 
-def get_cache_file():
-    """获取缓存文件路径"""
-    return os.path.join(get_workflow_data_dir(), "translation_cache.json")
+# 流式模式下Alfred重新运行Script Filter的间隔（秒，Alfred允许0.1~5）
+STREAM_RERUN_INTERVAL = 0.1
+# 进度超过该时间未更新视为后台进程已退出（秒）
+STREAM_STALE_SECONDS = 35
+# 输入判断使用的字符类
+INCOMPLETE_PUNCTUATION = ('，', '、', '；', '：')
+# 与string.punctuation相同，写成常量以免导入string模块
+ASCII_PUNCTUATION = r"""!"#$%&'()*+,-./:;<=>?@[\]^_`{|}~"""
+# 标点（英文标点及常用中文标点）和空白不计入有效字符
+NON_CONTENT_PATTERN = re.compile('[\\s' + re.escape(ASCII_PUNCTUATION + '，。！？；：""（）【】《》、') + ']')
+# 不翻译时按原因显示的提示
+WAITING_SUBTITLES = {
+    "no_chinese": "未检测到中文，输入中文后开始翻译..."
+}
 
-def load_cache():
-    """加载翻译缓存"""
-    cache_file = get_cache_file()
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache = json.load(f)
-                # 清理超过24小时的缓存
-                current_time = time.time()
-                cleaned_cache = {}
-                for key, value in cache.items():
-                    if current_time - value.get('timestamp', 0) < 86400:  # 24小时
-                        cleaned_cache[key] = value
-                return cleaned_cache
-        except:
-            pass
-    return {}
+# 两次预热之间的最短间隔（秒），反复打开Alfred时不会每次都启动预热；连接池中的空闲连接保留60秒
+WARMUP_INTERVAL = 30
 
-def save_cache(cache):
-    """保存翻译缓存"""
-    cache_file = get_cache_file()
-    try:
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
-    except:
-        pass
 
-def get_cache_key(text, config):
-    """生成缓存键"""
-    # 使用文本、模型和提示词生成唯一键
-    key_data = f"{text}|{config.get('model', '')}|{config.get('prompt', '')}"
-    return hashlib.md5(key_data.encode('utf-8')).hexdigest()
+def classify_input(text):
+    """判断输入是否应该翻译，返回包含判断结果和原因的字典
+
+    过滤条件：
+    1. 长度至少3个字符
+    2. 包含中文字符
+    3. 不以常见的中间标点符号结尾（避免句子未完成就翻译）
+    4. 有足够的非标点字符
+    5. 如果包含逗号但没有完整的句子结构，可能未完成
+    """
+    # 按代价从低到高判断，每次按键的短输入在前几步就返回；正则在导入时编译，逐字符判断都在C代码中完成
+    if len(text) < 3:
+        return {"translate": False, "reason": "too_short"}
+    if not translation_engine.CHINESE_PATTERN.search(text):
+        return {"translate": False, "reason": "no_chinese"}
+    if text.rstrip().endswith(INCOMPLETE_PUNCTUATION):
+        # 以中间标点符号结尾，句子可能未完成
+        return {"translate": False, "reason": "incomplete_punctuation"}
+    if len(text) - len(NON_CONTENT_PATTERN.findall(text)) < 3:
+        # 至少需要3个非标点字符
+        return {"translate": False, "reason": "too_few_characters"}
+    if text.count('，') == 1 and len(NON_CONTENT_PATTERN.sub('', text.split('，', 1)[1])) <= 2:
+        # 只有一个逗号且逗号后只有1-2个字符，例如 "你好，世" 可能是 "你好，世界" 的一部分
+        return {"translate": False, "reason": "incomplete_clause"}
+    return {"translate": True, "reason": "ok"}
 
 def should_translate(text):
     """判断是否应该进行翻译"""
-    # 过滤条件：
-    # 1. 长度至少3个字符
-    # 2. 包含中文字符
-    # 3. 不以常见的中间标点符号结尾（避免句子未完成就翻译）
-    # 4. 有足够的非标点字符
-    # 5. 如果包含逗号但没有完整的句子结构，可能未完成
-    
-    if len(text) < 3:
-        return False
-    
-    # 检查是否包含中文字符
-    has_chinese = any('\u4e00' <= char <= '\u9fff' for char in text)
-    if not has_chinese:
-        return False
-    
-    # 检查是否以中间标点符号结尾（表示句子可能未完成）
-    incomplete_punctuation = '，、；：'
-    if text.rstrip().endswith(tuple(incomplete_punctuation)):
-        return False
-    
-    # 检查非标点字符数量
-    import string
-    chinese_punctuation = '，。！？；：""''（）【】《》、'
-    all_punctuation = string.punctuation + chinese_punctuation
-    non_punct_chars = [char for char in text if char not in all_punctuation and not char.isspace()]
-    
-    # 至少需要3个非标点字符
-    if len(non_punct_chars) < 3:
-        return False
-    
-    # 额外检查：如果包含逗号但句子很短且可能未完成
-    # 例如："你好，世" 可能是 "你好，世界" 的一部分
-    if '，' in text:
-        # 如果逗号后面的内容很少，可能是未完成的句子
-        comma_parts = text.split('，')
-        if len(comma_parts) == 2:  # 只有一个逗号
-            after_comma = comma_parts[1].strip()
-            # 如果逗号后只有1-2个字符，可能未完成
-            after_comma_chars = [char for char in after_comma if char not in all_punctuation and not char.isspace()]
-            if len(after_comma_chars) <= 2:
-                return False
-    
-    return True
+    # 过短的输入不必构造判断结果
+    return len(text) >= 3 and classify_input(text)["translate"]
 
-def load_config():
-    """加载配置"""
-    config_file = os.path.join(get_workflow_data_dir(), "config.json")
-    default_config = {
-        "api_url": "https://api.openai.com/v1/chat/completions",
-        "api_key": "",
-        "model": "gpt-3.5-turbo",
-        "prompt": "请将以下中文翻译成自然、口语化的英文，适合在聊天、论坛等非正式场合使用。保持原意的同时，让表达更加地道和自然："
-    }
-    
-    if os.path.exists(config_file):
-        try:
-            with open(config_file, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                # 合并默认配置
-                for key, value in default_config.items():
-                    if key not in config:
-                        config[key] = value
-                return config
-        except:
-            pass
-    
-    return default_config
+def prefetch_prefix(text, config):
+    """输入未完成时在后台预先翻译已完整的分句前缀"""
+    prefix = translation_engine.get_clause_prefix(text)
+    if not prefix or not should_translate(prefix):
+        return
+    if translation_engine.lookup_cache(prefix, config, record=False) is not None:
+        return
+    if inflight.is_inflight(translation_engine.get_workflow_data_dir(), translation_engine.get_cache_key(prefix, config)):
+        return
+    start_worker(prefix, prefetch=True)
 
-def translate_text(text, config):
-    """调用API翻译文本"""
-    if not config.get("api_key"):
-        return "错误：请先配置API Key（使用 tset 命令）"
-    
-    # 检查缓存
-    cache = load_cache()
-    cache_key = get_cache_key(text, config)
-    
-    if cache_key in cache:
-        return cache[cache_key]['translation']
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {config['api_key']}",
-        "User-Agent": "Colloquial-Translator/2.1",
-        "Accept": "application/json"
-    }
-    
-    data = {
-        "model": config.get("model", "gpt-3.5-turbo"),
-        "messages": [
-            {
-                "role": "system",
-                "content": config.get("prompt", "请将以下中文翻译成自然、口语化的英文：")
-            },
-            {
-                "role": "user",
-                "content": text
-            }
-        ],
-        "temperature": 0.7,
-        "max_tokens": 1000
-    }
-    
+def get_progress_file(text, config):
+    """获取流式翻译进度文件路径（每个查询一个）"""
+    progress_dir = os.path.join(translation_engine.get_workflow_data_dir(), "progress")
+    if not os.path.exists(progress_dir):
+        os.makedirs(progress_dir, exist_ok=True)
+    return os.path.join(progress_dir, f"{translation_engine.get_cache_key(text, config)}.json")
+
+def read_progress(text, config):
+    """读取流式翻译进度，不存在时返回None"""
     try:
-        req = urllib.request.Request(
-            config.get("api_url", "https://api.openai.com/v1/chat/completions"),
-            data=json.dumps(data).encode('utf-8'),
-            headers=headers
-        )
-        
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            
-            if 'choices' in result and len(result['choices']) > 0:
-                translated_text = result['choices'][0]['message']['content'].strip()
-                
-                # 保存到缓存
-                cache[cache_key] = {
-                    'translation': translated_text,
-                    'timestamp': time.time()
-                }
-                save_cache(cache)
-                
-                return translated_text
-            else:
-                return "翻译失败：API返回格式错误"
-                
-    except urllib.error.HTTPError as e:
-        error_msg = e.read().decode('utf-8')
-        try:
-            error_data = json.loads(error_msg)
-            if 'error' in error_data:
-                return f"API错误：{error_data['error'].get('message', '未知错误')}"
-        except:
-            pass
-        return f"HTTP错误：{e.code} {e.reason}"
-    except urllib.error.URLError as e:
-        return f"网络错误：{e.reason}"
-    except Exception as e:
-        return f"翻译失败：{str(e)}"
+        with open(get_progress_file(text, config), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-def speak_text(text):
-    """使用系统语音朗读文本"""
+def write_progress(text, config, progress):
+    """写入流式翻译进度（先写临时文件再改名，避免读到半截内容）"""
+    progress["updated"] = time.time()
     try:
-        # 使用macOS的say命令
-        subprocess.run(["say", text], check=False)
-    except:
+        translation_engine.write_json_file(get_progress_file(text, config), progress)
+    except OSError:
         pass
 
-def main():
-    if len(sys.argv) < 2:
-        # 返回空结果
-        result = {
-            "items": [
-                {
-                    "uid": "empty",
-                    "title": "请输入要翻译的中文文本",
-                    "subtitle": "输入中文后将显示翻译结果 | Cmd+回车朗读",
-                    "arg": "",
-                    "valid": False
-                }
-            ]
-        }
-        print(json.dumps(result, ensure_ascii=False))
+def clear_progress(text, config):
+    """删除流式翻译进度文件"""
+    try:
+        os.remove(get_progress_file(text, config))
+    except OSError:
+        pass
+
+def start_worker(text, prefetch=False, warmup=False, variant=None):
+    """在后台启动翻译进程；variant为多候选模式中要翻译的变体序号"""
+    import subprocess
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "translate_worker.py")
+    if warmup:
+        args = [sys.executable, script, "--warmup"]
+    elif variant is not None:
+        args = [sys.executable, script, "--variant", str(variant), text]
+    else:
+        args = [sys.executable, script] + (["--prefetch"] if prefetch else []) + [text]
+    try:
+        subprocess.Popen(
+            args,
+            cwd=os.path.dirname(script),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+    except OSError:
+        pass
+
+def start_warmup():
+    """Alfred刚打开关键字（输入为空）时预热，输入完成时连接已建好
+
+    常驻进程在运行时由它建立连接并保留在其连接池中；否则在后台进程中预热，
+    此时连接随进程结束，只有DNS缓存和服务端的预热能保留下来。
+    """
+    config = translation_engine.load_config()
+    if not config.get("warmup") or not config.get("api_key"):
         return
-    
-    text = sys.argv[1].strip()
-    if not text:
-        # 返回空结果
-        result = {
-            "items": [
-                {
-                    "uid": "empty",
-                    "title": "请输入要翻译的中文文本",
-                    "subtitle": "输入中文后将显示翻译结果 | Cmd+回车朗读",
-                    "arg": "",
-                    "valid": False
-                }
-            ]
-        }
-        print(json.dumps(result, ensure_ascii=False))
+    if not translation_engine.claim_interval("warmup", WARMUP_INTERVAL):
         return
-    
-    config = load_config()
-    
+    if translate_daemon.warm_daemon():
+        return
+    if config.get("use_daemon"):
+        # 常驻进程启动后会自行预热
+        translate_daemon.start_daemon()
+    else:
+        start_worker("", warmup=True)
+
+def get_query_key(text, config, verdict):
+    """inflight会话中登记的查询键；不会发出请求时无需计算缓存键"""
+    if verdict["translate"] and config.get("api_key"):
+        return translation_engine.get_cache_key(text, config)
+    return f"waiting:{text}"
+
+def build_result(text, config, verdict=None):
+    """根据输入文本和配置生成Alfred结果；verdict为已算好的classify_input()结果"""
     # 检查配置
     if not config.get("api_key"):
-        result = {
+        return {
             "items": [
                 {
                     "uid": "error",
@@ -256,34 +173,48 @@ def main():
                 }
             ]
         }
-        print(json.dumps(result, ensure_ascii=False))
-        return
     
     # 智能判断是否应该翻译
-    if not should_translate(text):
-        result = {
+    if verdict is None:
+        with metrics.span("gate"):
+            verdict = classify_input(text)
+    if not verdict["translate"]:
+        metrics.tag("outcome", "waiting")
+        if config.get("speculative"):
+            prefetch_prefix(text, config)
+        return {
             "items": [
                 {
                     "uid": "waiting",
                     "title": f"输入中: {text}",
-                    "subtitle": "继续输入完整内容以开始翻译...",
+                    "subtitle": WAITING_SUBTITLES.get(verdict["reason"], "继续输入完整内容以开始翻译..."),
                     "arg": "",
                     "valid": False
                 }
             ]
         }
-        print(json.dumps(result, ensure_ascii=False))
-        return
     
-    # 进行翻译
-    translated = translate_text(text, config)
+    if config.get("variants"):
+        return build_variants_result(text, config)
+    
+    if config.get("stream"):
+        return build_stream_result(text, config)
     
-    # 检查是否是错误信息
-    is_error = any(translated.startswith(prefix) for prefix in [
-        "错误：", "翻译失败：", "API错误：", "HTTP错误：", "网络错误："
-    ])
+    if config.get("fuzzy_cache") and translation_engine.lookup_cache(text, config, record=False) is None:
+        approximate = translation_engine.find_similar_translation(text, config)
+        if approximate:
+            # 先显示相似原文的译文，后台获取准确翻译后通过rerun替换
+            return build_stream_result(text, config, approximate)
     
-    if is_error:
+    # 进行翻译
+    result = translation_engine.translate_text(text, config)
+    return make_translation_result(text, result)
+
+def make_translation_result(text, result):
+    """把翻译结果字典（见translation_engine.make_result）转换为Alfred结果"""
+    translated = result.get("text", "")
+    
+    if not translation_engine.is_ok(result):
         result = {
             "items": [
                 {
@@ -315,7 +246,196 @@ def main():
             ]
         }
     
-    print(json.dumps(result, ensure_ascii=False))
+    return result
+
+def build_variants_result(text, config):
+    """多候选模式：各模型/提示词变体分别在后台进程中流式翻译，完成一个显示一个，通过rerun轮询
+
+    已缓存的变体直接显示；全部完成后不再rerun，并删除各变体的进度文件。
+    """
+    metrics.tag("outcome", "variants")
+    items = []
+    finished = []
+    pending = False
+    for index, variant in enumerate(translation_engine.get_variants(config)):
+        label = variant["variant_name"]
+        # 有进度文件说明是rerun轮询，本次查询已计入缓存统计
+        progress = read_progress(text, variant)
+        cached = translation_engine.lookup_cache(text, variant, record=progress is None)
+        if cached is not None:
+            # 缓存可能在rerun期间由后台进程写入，进度文件也要一起清理
+            finished.append(variant)
+            items.append(make_variant_item(text, translation_engine.make_result("ok", cached, cached=True), index, label))
+            continue
+        
+        if progress and progress.get("done"):
+            # 其他变体还在翻译时保留进度文件，下次rerun仍能显示
+            finished.append(variant)
+            items.append(make_variant_item(text, progress, index, label))
+            continue
+        
+        if progress is None or time.time() - progress.get("updated", 0) > STREAM_STALE_SECONDS:
+            write_progress(text, variant, {"text": "", "done": False})
+            start_worker(text, variant=index)
+            progress = {"text": ""}
+        pending = True
+        partial = progress.get("text", "")
+        items.append({
+            "uid": f"variant-{index}",
+            "title": f"{partial}…" if partial else "正在翻译...",
+            "subtitle": f"{label} | 原文: {text} | 正在接收翻译结果...",
+            "arg": "",
+            "valid": False
+        })
+    
+    if not pending:
+        for variant in finished:
+            clear_progress(text, variant)
+        return {"items": items}
+    return {"rerun": STREAM_RERUN_INTERVAL, "items": items}
+
+def make_variant_item(text, result, index, label):
+    """多候选模式中一个变体的条目：副标题以变体名称开头，uid按序号区分"""
+    item = make_translation_result(text, result)["items"][0]
+    item["uid"] = f"variant-{index}"
+    item["subtitle"] = f"{label} | {item['subtitle']}"
+    return item
+
+def build_stream_result(text, config, approximate=None):
+    """流式模式：后台进程逐步写入进度，Script Filter通过rerun轮询显示
+
+    approximate为相似原文的缓存(相似度, 原文, 译文)，收到译文前先显示它。
+    """
+    # 有进度文件说明是rerun轮询，本次查询已计入缓存统计
+    progress = read_progress(text, config)
+    cached = translation_engine.lookup_cache(text, config, record=progress is None)
+    if cached is not None:
+        metrics.tag("outcome", "cache")
+        if progress and progress.get("done"):
+            # 本次查询到此结束，留下的进度文件会使下次同样的输入不计入统计
+            clear_progress(text, config)
+        return make_translation_result(text, translation_engine.make_result("ok", cached, cached=True))
+    
+    metrics.tag("outcome", "stream")
+    if progress and progress.get("done"):
+        # 翻译已结束，删除进度文件；出错时下次输入会重新请求
+        clear_progress(text, config)
+        # 结束时的进度即后台进程得到的结果字典
+        return make_translation_result(text, progress)
+    
+    if progress is None or time.time() - progress.get("updated", 0) > STREAM_STALE_SECONDS:
+        # 尚未开始，或后台进程已异常退出
+        write_progress(text, config, {"text": "", "done": False})
+        start_worker(text)
+        progress = {"text": ""}
+    
+    partial = progress.get("text", "")
+    if not partial and config.get("fuzzy_cache"):
+        approximate = approximate or translation_engine.find_similar_translation(text, config)
+    if not partial and approximate:
+        score, source, translation = approximate
+        return {
+            "rerun": STREAM_RERUN_INTERVAL,
+            "items": [
+                {
+                    "uid": "translation",
+                    "title": f"≈ {translation}",
+                    "subtitle": f"近似结果（相似度{score:.0%}，原文: {source}）| 正在获取准确翻译...",
+                    "arg": translation,
+                    "valid": True,
+                    "mods": {
+                        "cmd": {
+                            "subtitle": f"朗读: {translation}",
+                            "arg": f"speak:{translation}"
+                        }
+                    }
+                }
+            ]
+        }
+    
+    return {
+        "rerun": STREAM_RERUN_INTERVAL,
+        "items": [
+            {
+                "uid": "translation",
+                "title": f"{partial}…" if partial else "正在翻译...",
+                "subtitle": f"原文: {text} | 正在接收翻译结果...",
+                "arg": "",
+                "valid": False
+            }
+        ]
+    }
+
+def main():
+    if len(sys.argv) < 2:
+        # 返回空结果
+        result = {
+            "items": [
+                {
+                    "uid": "empty",
+                    "title": "请输入要翻译的中文文本",
+                    "subtitle": "输入中文后将显示翻译结果 | Cmd+回车朗读",
+                    "arg": "",
+                    "valid": False
+                }
+            ]
+        }
+        print(json.dumps(result, ensure_ascii=False))
+        translation_engine.end_output()
+        start_warmup()
+        return
+    
+    text = sys.argv[1].strip()
+    if not text:
+        # 返回空结果
+        result = {
+            "items": [
+                {
+                    "uid": "empty",
+                    "title": "请输入要翻译的中文文本",
+                    "subtitle": "输入中文后将显示翻译结果 | Cmd+回车朗读",
+                    "arg": "",
+                    "valid": False
+                }
+            ]
+        }
+        print(json.dumps(result, ensure_ascii=False))
+        translation_engine.end_output()
+        start_warmup()
+        return
+    
+    if _daemon_ms is not None:
+        # 常驻进程已在导入引擎模块之前返回了结果，这里只记录耗时
+        metrics.start("filter", began=_started)
+        metrics.add_span("daemon", _daemon_ms)
+        metrics.tag("outcome", "daemon")
+        metrics.flush()
+        return
+    
+    metrics.start("filter")
+    with metrics.span("config"):
+        config = translation_engine.load_config()
+    if config.get("use_daemon"):
+        # 后台启动常驻进程，本次仍在当前进程内完成翻译
+        translate_daemon.start_daemon()
+    
+    with metrics.span("gate"):
+        verdict = classify_input(text)
+    
+    # 登记本次查询，取消仍在进行的旧查询
+    data_dir = translation_engine.get_workflow_data_dir()
+    inflight.exit_on_sigterm()
+    inflight.register_query(data_dir, get_query_key(text, config, verdict))
+    try:
+        result = build_result(text, config, verdict)
+    finally:
+        inflight.unregister_query(data_dir)
+    with metrics.span("output"):
+        print(json.dumps(result, ensure_ascii=False))
+        # 关闭输出后Alfred即可显示结果，写缓存等收尾操作不再占用等待时间
+        translation_engine.end_output()
+    translation_engine.run_deferred()
+    metrics.flush(config)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import time
+import inflight
+import metrics
+import translate_filter_v2
+import translation_engine
+
+# 进度写入的最小间隔（秒），避免每个token都写一次文件
+PROGRESS_WRITE_INTERVAL = 0.05
+# 进度文件保留时间（秒），用户放弃的查询由后台进程顺便清理
+PROGRESS_MAX_AGE = 3600
+
+def cleanup_progress_files():
+    """清理过期的进度文件"""
+    progress_dir = os.path.join(translation_engine.get_workflow_data_dir(), "progress")
+    current_time = time.time()
+    try:
+        for name in os.listdir(progress_dir):
+            path = os.path.join(progress_dir, name)
+            try:
+                if current_time - os.path.getmtime(path) > PROGRESS_MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+    except OSError:
+        pass
+
+def run_stream(text, config):
+    """流式翻译并持续写入进度文件"""
+    last_write = [0.0]
+
+    def on_progress(partial):
+        now = time.time()
+        if now - last_write[0] >= PROGRESS_WRITE_INTERVAL:
+            translate_filter_v2.write_progress(text, config, {"text": partial, "done": False})
+            last_write[0] = now
+
+    # Script Filter已查过缓存并计入统计
+    result = translation_engine.translate_text_stream(text, config, on_progress, record=False)
+    translate_filter_v2.write_progress(text, config, dict(result, done=True))
+
+def main():
+    if len(sys.argv) < 2:
+        return
+    
+    if sys.argv[1] == "--warmup":
+        translation_engine.warm_up(translation_engine.load_config())
+        return
+    
+    if sys.argv[1] == "--prefetch":
+        # 预翻译：只写入缓存，不登记会话，避免被后续按键取消
+        if len(sys.argv) > 2:
+            translation_engine.translate_text(sys.argv[2], translation_engine.load_config(), record=False)
+        return
+    
+    variant = None
+    if sys.argv[1] == "--variant":
+        # 多候选模式：翻译第N个变体
+        if len(sys.argv) < 4:
+            return
+        variant, text = int(sys.argv[2]), sys.argv[3]
+    else:
+        text = sys.argv[1]
+    metrics.start("worker")
+    with metrics.span("config"):
+        config = translation_engine.load_config()
+    translate_config = config
+    if variant is not None:
+        variants = translation_engine.get_variants(config)
+        if variant >= len(variants):
+            return
+        translate_config = variants[variant]
+    
+    # 与Script Filter登记在同一会话中，用户改了输入后旧的后台请求会被取消；
+    # 会话按主配置的查询登记，同一输入的各变体进程不会互相取消
+    data_dir = translation_engine.get_workflow_data_dir()
+    inflight.exit_on_sigterm()
+    inflight.register_query(data_dir, translation_engine.get_cache_key(text, config))
+    finished = False
+    try:
+        run_stream(text, translate_config)
+        finished = True
+    finally:
+        inflight.unregister_query(data_dir)
+        if not finished:
+            # 被取消时删除未完成的进度，下次查询会重新开始
+            translate_filter_v2.clear_progress(text, translate_config)
+    # 最终进度已写入，再写缓存
+    translation_engine.run_deferred()
+    metrics.flush(config)
+    cleanup_progress_files()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+import collections
+
+# 缓存有效期（秒），可通过配置cache_ttl修改
+CACHE_TTL = 86400
+# 过期清理间隔（秒），避免每次写入都全表扫描
+SWEEP_INTERVAL = 3600
+# 持久缓存默认最多保留的条目数，可通过配置cache_max_entries修改
+MAX_ENTRIES = 20000
+# 内存缓存默认条目数，可通过配置cache_memory_entries修改
+MEMORY_ENTRIES = 1000
+# 每次写入时检查容量上限的概率，避免每次都COUNT全表
+LIMIT_CHECK_PROBABILITY = 0.02
+# 计数器累计到该数量时写入数据库，进程退出时也会写入
+STATS_FLUSH_THRESHOLD = 50
+
+# 条目占用字节数（原文+译文）
+SIZE_EXPR = "length(CAST(translation AS BLOB)) + length(CAST(COALESCE(source, '') AS BLOB))"
+
+# SQLite连接不能跨线程使用，按线程复用已打开的连接
+_local = threading.local()
+
+# 进程内LRU缓存：缓存键 -> (译文, 写入时间, 原文)
+_memory = collections.OrderedDict()
+_memory_lock = threading.Lock()
+
+# 命中、未命中、淘汰等计数，先在内存中累计再批量写入数据库
+_pending_stats = collections.Counter()
+_stats_lock = threading.Lock()
+_stats_data_dir = None
+# 命中条目的访问记录：缓存键 -> [最后访问时间, 命中次数]，与计数一起批量写入，查询时不占用写锁
+_pending_access = {}
+
+def get_cache_settings(config):
+    """从配置中读取缓存参数"""
+    return {
+        "ttl": float(config.get("cache_ttl", CACHE_TTL)),
+        "max_entries": int(config.get("cache_max_entries", MAX_ENTRIES) or 0),
+        "max_bytes": int(config.get("cache_max_bytes", 0) or 0),
+        "eviction": "lfu" if config.get("cache_eviction") == "lfu" else "lru",
+        "memory_entries": int(config.get("cache_memory_entries", MEMORY_ENTRIES) or 0)
+    }
+
+DEFAULT_SETTINGS = get_cache_settings({})
+
+def get_cache_db_file(data_dir):
+    """获取SQLite缓存数据库路径"""
+    return os.path.join(data_dir, "translation_cache.db")
+
+def get_legacy_cache_file(data_dir):
+    """获取旧版JSON缓存文件路径"""
+    return os.path.join(data_dir, "translation_cache.json")
+
+def open_cache(data_dir):
+    """打开缓存数据库（同一线程内复用连接）"""
+    global _stats_data_dir
+    connections = _local.__dict__.setdefault('connections', {})
+    conn = connections.get(data_dir)
+    if conn is None:
+        conn = connect_cache(data_dir)
+        connections[data_dir] = conn
+        if _stats_data_dir is None:
+            _stats_data_dir = data_dir
+            atexit.register(flush_stats)
+    return conn
+
+def connect_cache(data_dir):
+    """新建缓存数据库连接，必要时建表并迁移旧版JSON缓存"""
+    conn = sqlite3.connect(get_cache_db_file(data_dir), timeout=5, isolation_level=None)
+    # WAL模式下读写互不阻塞，多个Script Filter进程可以同时访问
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS translations (
+            key TEXT PRIMARY KEY,
+            source TEXT,
+            translation TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            last_access REAL NOT NULL DEFAULT 0,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(translations)")]
+    if "last_access" not in columns:
+        # 旧版数据库补充淘汰策略需要的列
+        conn.execute("ALTER TABLE translations ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE translations ADD COLUMN hits INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE translations SET last_access = timestamp")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_timestamp ON translations(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_lru ON translations(last_access)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_lfu ON translations(hits, last_access)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    # 否定缓存：短时间内相同请求直接返回上次的错误
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS failures (
+            key TEXT PRIMARY KEY,
+            message TEXT NOT NULL,
+            http_status INTEGER,
+            expires REAL NOT NULL
+        )
+    """)
+
+    if os.path.exists(get_legacy_cache_file(data_dir)):
+        migrate_json_cache(conn, data_dir)
+
+    return conn
+
+def migrate_json_cache(conn, data_dir):
+    """将旧版translation_cache.json一次性导入数据库"""
+    legacy_file = get_legacy_cache_file(data_dir)
+    try:
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except Exception:
+        cache = {}
+
+    rows = []
+    current_time = time.time()
+    for key, value in cache.items():
+        if not isinstance(value, dict) or 'translation' not in value:
+            continue
+        timestamp = value.get('timestamp', 0)
+        if current_time - timestamp < CACHE_TTL:
+            rows.append((key, None, value['translation'], timestamp, timestamp))
+
+    # 自动提交模式下显式开启事务，批量导入只需一次落盘
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(
+            "INSERT OR IGNORE INTO translations (key, source, translation, timestamp, last_access) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        return
+
+    # 迁移完成后改名保留，避免重复导入
+    try:
+        os.replace(legacy_file, legacy_file + ".migrated")
+    except OSError:
+        pass
+
+def _memory_get(key, ttl):
+    """查询进程内缓存，返回(译文, 写入时间, 原文)"""
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] >= ttl:
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return entry
+
+def _memory_set(key, translation, timestamp, source, limit):
+    """写入进程内缓存，超出条目数时淘汰最久未使用的条目"""
+    if limit <= 0:
+        return
+    evicted = 0
+    with _memory_lock:
+        _memory[key] = (translation, timestamp, source)
+        _memory.move_to_end(key)
+        while len(_memory) > limit:
+            _memory.popitem(last=False)
+            evicted += 1
+    if evicted:
+        _record("memory_evictions", evicted)
+
+def _record(name, count=1):
+    """累计计数，达到阈值时写入数据库"""
+    with _stats_lock:
+        _pending_stats[name] += count
+        should_flush = sum(_pending_stats.values()) >= STATS_FLUSH_THRESHOLD
+    if should_flush:
+        flush_stats()
+
+def _record_access(key, access_time):
+    """在内存中记录一次命中的访问时间和次数，供LRU/LFU淘汰使用"""
+    with _stats_lock:
+        entry = _pending_access.setdefault(key, [0.0, 0])
+        entry[0] = access_time
+        entry[1] += 1
+
+def flush_stats():
+    """把累计的计数和访问记录在一个事务中写入数据库"""
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+        accesses = [(access_time, hits, key) for key, (access_time, hits) in _pending_access.items()]
+        _pending_access.clear()
+    if (not pending and not accesses) or _stats_data_dir is None:
+        return
+    try:
+        conn = open_cache(_stats_data_dir)
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                list(pending.items())
+            )
+            conn.executemany(
+                "UPDATE translations SET last_access = MAX(last_access, ?), hits = hits + ? WHERE key = ?",
+                accesses
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+    except sqlite3.Error:
+        pass
+
+def _record_hit(name, stored_source, source):
+    """记录命中，原文不同（仅靠规范化才命中）时另外计数"""
+    _record(name)
+    if source is not None and stored_source is not None and stored_source != source:
+        _record("normalized_hits")
+
+def cache_get(conn, key, settings=None, source=None, record=True):
+    """按缓存键查询未过期的翻译，先查内存再查数据库，未命中返回None
+
+    source为本次查询的原文，用于统计规范化缓存键带来的额外命中。record为False时不计入命中统计
+    和访问记录，用于同一查询中的重复查询（等待其他进程、rerun轮询、前缀查找等），每次查询只计一次。
+    """
+    settings = settings or DEFAULT_SETTINGS
+    ttl = settings["ttl"]
+    cached = _memory_get(key, ttl)
+    if cached is not None:
+        if record:
+            _record_access(key, time.time())
+            _record_hit("memory_hits", cached[2], source)
+        return cached[0]
+
+    current_time = time.time()
+    row = conn.execute(
+        "SELECT translation, timestamp, source FROM translations WHERE key = ? AND timestamp >= ?",
+        (key, current_time - ttl)
+    ).fetchone()
+    if row is None:
+        if record:
+            _record("misses")
+        return None
+
+    if record:
+        # 访问记录先留在内存中，随计数在输出结果后或进程退出时写入
+        _record_access(key, current_time)
+        _record_hit("hits", row[2], source)
+    _memory_set(key, row[0], row[1], row[2], settings["memory_entries"])
+    return row[0]
+
+def cache_set(conn, key, source, translation, settings=None):
+    """写入单条翻译缓存"""
+    settings = settings or DEFAULT_SETTINGS
+    current_time = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO translations (key, source, translation, timestamp, last_access, hits) "
+        "VALUES (?, ?, ?, ?, ?, 0)",
+        (key, source, translation, current_time, current_time)
+    )
+    _memory_set(key, translation, current_time, source, settings["memory_entries"])
+
+    # 定期清理过期条目，容量上限按概率抽查
+    row = conn.execute("SELECT value FROM meta WHERE name = 'last_sweep'").fetchone()
+    last_sweep = float(row[0]) if row else 0
+    if current_time - last_sweep >= SWEEP_INTERVAL:
+        purge_expired(conn, settings["ttl"])
+        enforce_limits(conn, settings)
+        return
+    import random
+    if random.random() < LIMIT_CHECK_PROBABILITY:
+        enforce_limits(conn, settings)
+
+def failure_get(conn, key):
+    """查询未过期的否定缓存，返回(错误信息, HTTP状态码)，没有时返回None"""
+    return conn.execute(
+        "SELECT message, http_status FROM failures WHERE key = ? AND expires > ?",
+        (key, time.time())
+    ).fetchone()
+
+def failure_set(conn, key, message, http_status, ttl):
+    """写入否定缓存，ttl秒内相同请求直接返回该错误"""
+    conn.execute(
+        "INSERT OR REPLACE INTO failures (key, message, http_status, expires) VALUES (?, ?, ?, ?)",
+        (key, message, http_status, time.time() + ttl)
+    )
+
+def purge_expired(conn, ttl=CACHE_TTL):
+    """删除过期缓存（利用timestamp索引）和过期的否定缓存"""
+    current_time = time.time()
+    cursor = conn.execute("DELETE FROM translations WHERE timestamp < ?", (current_time - ttl,))
+    if cursor.rowcount > 0:
+        _record("expired", cursor.rowcount)
+    conn.execute("DELETE FROM failures WHERE expires < ?", (current_time,))
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (name, value) VALUES ('last_sweep', ?)",
+        (str(current_time),)
+    )
+
+def enforce_limits(conn, settings=None):
+    """按条目数和字节数上限淘汰缓存（LRU或LFU），返回淘汰条数"""
+    settings = settings or DEFAULT_SETTINGS
+    order = "hits ASC, last_access ASC" if settings["eviction"] == "lfu" else "last_access ASC"
+    evicted = 0
+
+    max_entries = settings["max_entries"]
+    if max_entries > 0:
+        count = conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        if count > max_entries:
+            cursor = conn.execute(
+                f"DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY {order} LIMIT ?)",
+                (count - max_entries,)
+            )
+            evicted += cursor.rowcount
+
+    max_bytes = settings["max_bytes"]
+    if max_bytes > 0:
+        total = conn.execute(f"SELECT COALESCE(SUM({SIZE_EXPR}), 0) FROM translations").fetchone()[0]
+        excess = total - max_bytes
+        if excess > 0:
+            victims = []
+            for key, size in conn.execute(f"SELECT key, {SIZE_EXPR} FROM translations ORDER BY {order}"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM translations WHERE key = ?", victims)
+            evicted += len(victims)
+
+    if evicted:
+        _record("evictions", evicted)
+    return evicted
+
+def cache_stats(conn):
+    """返回缓存统计：累计计数、命中率、当前条目数和占用字节数"""
+    flush_stats()
+    stats = {name: value for name, value in conn.execute("SELECT name, value FROM stats")}
+    entries, size = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM({SIZE_EXPR}), 0) FROM translations"
+    ).fetchone()
+    stats["entries"] = entries
+    stats["bytes"] = size
+    stats["memory_entries"] = len(_memory)
+    hits = stats.get("hits", 0) + stats.get("memory_hits", 0)
+    lookups = hits + stats.get("misses", 0)
+    stats["hit_rate"] = hits / lookups if lookups else 0.0
+    # 不做规范化时的命中率：去掉原文不同、只靠规范化键命中的部分
+    stats["raw_hit_rate"] = (hits - stats.get("normalized_hits", 0)) / lookups if lookups else 0.0
+    return stats
\ No newline at end of file
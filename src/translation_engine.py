@@ -0,0 +1,844 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import threading
+import contextvars
+import metrics
+import inflight
+
+# 翻译引擎：配置、缓存、请求构建与发送、分段和续译，Script Filter、translate.py、设置界面等入口共用
+# 网络（http_client）、缓存（sqlite3）、线程池等较重的模块只在函数内导入，提前返回的路径无需加载
+
+# 默认配置，配置文件中缺少的项以此补全
+DEFAULT_CONFIG = {
+    "api_url": "https://api.openai.com/v1/chat/completions",
+    "api_key": "",
+    "model": "gpt-3.5-turbo",
+    "prompt": "请将以下中文翻译成自然、口语化的英文，适合在聊天、论坛等非正式场合使用。保持原意的同时，让表达更加地道和自然："
+}
+# 分句标点，预翻译和续译以此切分前缀
+CLAUSE_PUNCTUATION = '，、；：。！？'
+# 续译时最多向前查找的分句前缀数
+MAX_PREFIX_LOOKUPS = 5
+# 规范化缓存键时去掉的句末标点（NFKC后的全角句点为"."）
+TERMINAL_PUNCTUATION = '。.'
+WHITESPACE_PATTERN = re.compile(r'\s+')
+CHINESE_PATTERN = re.compile('[\u4e00-\u9fff]+')
+# 长文本按句子切分：句末标点（及其后的引号、括号）或换行
+SENTENCE_PATTERN = re.compile(r'\n+|[^。！？\n]*[。！？]+[”’」』）)"]*|[^。！？\n]+')
+# 长文本每段的输入token预算，可通过配置chunk_tokens修改
+CHUNK_TOKENS = 400
+# 长文本分段翻译的并发数，可通过配置chunk_concurrency修改
+CHUNK_CONCURRENCY = 6
+# 精简提示词模式使用的系统提示词，输入token更少
+COMPACT_PROMPT = "把用户的中文译成地道、口语化的英文，只输出译文。"
+# 与请求内容有关的4xx错误（如400、413、422）的否定缓存时间（秒），可通过配置negative_cache_ttl修改
+NEGATIVE_CACHE_TTL = 60
+# 鉴权、超时和限流错误与请求内容无关，不做否定缓存，由熔断处理
+TRANSIENT_STATUSES = (401, 403, 408, 429)
+# 多候选模式中每个变体可以覆盖的配置项，未填写的沿用主配置
+VARIANT_KEYS = ("api_url", "api_key", "model", "prompt", "compact_prompt")
+# 预热请求使用的原文，只生成1个token
+WARMUP_TEXT = "你好"
+# 影响请求模板的配置项
+REQUEST_CONFIG_KEYS = ("api_url", "api_key", "model", "prompt", "compact_prompt", "prompt_cache")
+
+_data_dir = None
+# 按配置缓存的请求模板
+_request_templates = {}
+# 推迟到结果返回之后执行的收尾操作（写缓存、释放请求锁），按登记顺序执行
+_deferred = []
+_deferred_lock = threading.Lock()
+_deferred_registered = False
+# 当前查询的http_client.CancelToken（常驻进程中被后续按键取代的查询），由query_cancel()设置
+_query_cancel = contextvars.ContextVar("query_cancel", default=None)
+
+def get_workflow_data_dir():
+    """获取workflow数据目录"""
+    global _data_dir
+    # 常驻进程中重复调用时不再stat目录
+    if _data_dir is not None:
+        return _data_dir
+    bundle_id = "com.translator.alfred"
+    data_dir = os.path.expanduser(f"~/Library/Application Support/Alfred/Workflow Data/{bundle_id}")
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    _data_dir = data_dir
+    return data_dir
+
+def set_workflow_data_dir(data_dir):
+    """指定workflow数据目录（基准测试等在临时目录中运行），None表示恢复默认位置"""
+    global _data_dir
+    _data_dir = data_dir
+
+def load_config():
+    """加载配置，缺少的项使用默认值"""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(os.path.join(get_workflow_data_dir(), "config.json"), 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if isinstance(saved, dict):
+            config.update(saved)
+    except (OSError, ValueError):
+        pass
+    return config
+
+def write_json_file(path, data, sync=False, indent=None):
+    """原子地写入JSON文件：先写临时文件再改名替换，读取方不会读到半截内容；sync为True时替换前先落盘"""
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        # 写入失败或进程被终止时不留下临时文件
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+def update_json_file(path, update, sync=False, indent=None):
+    """在文件锁（path.lock）保护下读取、修改并原子地写回JSON文件，多个进程同时修改时互不覆盖
+
+    update(data)接收文件中的内容（文件不存在或损坏时为None），返回要写入的内容。
+    """
+    with open(path + ".lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        write_json_file(path, update(data), sync, indent)
+
+def save_config(config, keys=None):
+    """保存配置：加文件锁后与磁盘上的配置合并，只写入keys中的项（默认全部）
+
+    先写临时文件再改名替换，多个设置窗口同时修改不同项时互不覆盖，写入中途退出也不会损坏配置文件。
+    """
+    def update(saved):
+        saved = saved if isinstance(saved, dict) else {}
+        for key in (config if keys is None else keys):
+            saved[key] = config[key]
+        return saved
+    
+    update_json_file(os.path.join(get_workflow_data_dir(), "config.json"), update, sync=True, indent=2)
+
+def get_variants(config):
+    """多候选模式的变体列表：主配置在前，config["variants"]中的变体在后
+
+    每个变体是替换了模型、提示词等的完整配置，variant_name为显示的名称（默认为模型名）。
+    模型和提示词都计入缓存键，各变体的译文分别缓存；模型和提示词都与已有变体相同的会被忽略
+    （同一模型的其他接口地址应配置在endpoints中）。
+    """
+    variants = []
+    seen = set()
+    for extra in [{}] + list(config.get("variants") or []):
+        if not isinstance(extra, dict):
+            continue
+        variant = dict(config)
+        if extra:
+            # endpoints是主配置的备用接口，其他变体只使用自己的接口
+            variant.pop("endpoints", None)
+        variant.update({key: extra[key] for key in VARIANT_KEYS if key in extra})
+        signature = (variant.get("model"), get_system_prompt(variant))
+        if signature in seen:
+            continue
+        seen.add(signature)
+        variant["variant_name"] = extra.get("name") or variant.get("model", "")
+        variants.append(variant)
+    return variants
+
+def open_translation_cache():
+    """打开翻译缓存"""
+    import translation_cache
+    return translation_cache.open_cache(get_workflow_data_dir())
+
+def normalize_text(text, config):
+    """生成缓存键前规范化文本：NFKC、合并空白，可选去掉句末句号"""
+    if not config.get("cache_normalize", True):
+        return text
+    import unicodedata
+    # NFKC把全角字母数字和标点转为半角，但会把中文标点也一并转换，只在生成键时使用
+    text = unicodedata.normalize("NFKC", text)
+    text = WHITESPACE_PATTERN.sub(" ", text).strip()
+    if config.get("cache_strip_punctuation", True):
+        # 问号、感叹号会改变语气，只去掉句号
+        text = text.rstrip(TERMINAL_PUNCTUATION).rstrip() or text
+    return text
+
+def get_cache_key(text, config):
+    """生成缓存键"""
+    # 使用规范化后的文本、模型和提示词生成唯一键
+    prompt = get_system_prompt(config) if config.get("compact_prompt") else config.get("prompt", "")
+    key_data = f"{normalize_text(text, config)}|{config.get('model', '')}|{prompt}"
+    import hashlib
+    return hashlib.md5(key_data.encode('utf-8')).hexdigest()
+
+def lookup_cache(text, config, record=True):
+    """查询缓存，未命中或缓存不可用时返回None；record见translation_cache.cache_get()"""
+    try:
+        with metrics.span("cache_lookup"):
+            import translation_cache
+            return translation_cache.cache_get(
+                open_translation_cache(),
+                get_cache_key(text, config),
+                translation_cache.get_cache_settings(config),
+                text,
+                record
+            )
+    except Exception:
+        return None
+
+def is_content_error(result):
+    """是否为与请求内容有关的4xx错误：原样重发会得到同样的错误，也不说明接口有问题"""
+    status = result.get("http_status")
+    return status is not None and 400 <= status < 500 and status not in TRANSIENT_STATUSES
+
+def lookup_failure(text, config):
+    """查询否定缓存，相同请求不久前返回过与内容有关的4xx错误时返回该错误结果，否则返回None"""
+    if float(config.get("negative_cache_ttl", NEGATIVE_CACHE_TTL)) <= 0:
+        return None
+    try:
+        import translation_cache
+        row = translation_cache.failure_get(open_translation_cache(), get_cache_key(text, config))
+    except Exception:
+        return None
+    if row is None:
+        return None
+    metrics.tag("outcome", "negative_cache")
+    return make_result("error", row[0], cached=True, http_status=row[1])
+
+def store_failure(text, config, result):
+    """与请求内容有关的4xx错误登记到否定缓存，和写缓存一样在结果返回后执行"""
+    ttl = float(config.get("negative_cache_ttl", NEGATIVE_CACHE_TTL))
+    if ttl <= 0 or not is_content_error(result):
+        return
+    
+    def write():
+        import translation_cache
+        translation_cache.failure_set(
+            open_translation_cache(), get_cache_key(text, config), result["text"], result["http_status"], ttl
+        )
+    
+    defer(write)
+
+def defer(action):
+    """登记收尾操作，在结果返回给Alfred后由run_deferred()执行，进程退出时兜底执行"""
+    global _deferred_registered
+    with _deferred_lock:
+        _deferred.append(action)
+        if not _deferred_registered:
+            import atexit
+            atexit.register(run_deferred)
+            _deferred_registered = True
+
+def run_deferred():
+    """执行已登记的收尾操作，失败时忽略"""
+    while True:
+        with _deferred_lock:
+            if not _deferred:
+                return
+            action = _deferred.pop(0)
+        try:
+            action()
+        except Exception:
+            pass
+
+def end_output():
+    """结束标准输出：Alfred读到EOF即显示结果，不必等进程退出，之后的收尾操作不再占用等待时间
+
+    把/dev/null复制到文件描述符1上，管道随之关闭，之后误写的输出被丢弃，描述符1也不会被新打开的文件占用。
+    """
+    try:
+        sys.stdout.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.close(devnull)
+    except (OSError, ValueError):
+        pass
+
+def store_cache(text, config, translated_text):
+    """登记缓存写入，不占用返回结果的时间"""
+    defer(lambda: write_cache(text, config, translated_text))
+
+def write_cache(text, config, translated_text):
+    """写入缓存，失败时忽略"""
+    try:
+        with metrics.span("cache_write"):
+            import translation_cache
+            conn = open_translation_cache()
+            cache_key = get_cache_key(text, config)
+            translation_cache.cache_set(
+                conn,
+                cache_key,
+                text,
+                translated_text,
+                translation_cache.get_cache_settings(config)
+            )
+            if config.get("fuzzy_cache"):
+                import similarity_index
+                similarity_index.add_entry(conn, cache_key, normalize_text(text, config), get_similarity_scope(config))
+    except Exception:
+        pass
+
+def get_similarity_scope(config):
+    """相似度索引的作用域：只匹配相同模型和提示词的译文"""
+    import hashlib
+    return hashlib.md5(f"{config.get('model', '')}|{get_system_prompt(config)}".encode('utf-8')).hexdigest()
+
+def find_similar_translation(text, config):
+    """查找原文相近的已缓存译文，返回(相似度, 原文, 译文)或None"""
+    try:
+        import similarity_index
+        import translation_cache
+        settings = translation_cache.get_cache_settings(config)
+        return similarity_index.find_similar(
+            open_translation_cache(),
+            normalize_text(text, config),
+            get_similarity_scope(config),
+            time.time() - settings["ttl"],
+            float(config.get("fuzzy_threshold", similarity_index.DEFAULT_THRESHOLD)),
+            lambda source: normalize_text(source, config),
+            get_cache_key(text, config)
+        )
+    except Exception:
+        return None
+
+def get_system_prompt(config):
+    """实际发送的系统提示词，精简模式下使用简短版本"""
+    if config.get("compact_prompt"):
+        return COMPACT_PROMPT
+    return config.get("prompt", "请将以下中文翻译成自然、口语化的英文：")
+
+def get_request_template(config):
+    """按配置预先构建请求模板（URL、请求头、已序列化的固定前缀），同一配置只构建一次"""
+    signature = tuple(config.get(name) for name in REQUEST_CONFIG_KEYS)
+    template = _request_templates.get(signature)
+    if template is not None:
+        return template
+    
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {config['api_key']}",
+        "User-Agent": "Colloquial-Translator/2.1",
+        "Accept": "application/json"
+    }
+    prompt = get_system_prompt(config)
+    head = {"model": config.get("model", "gpt-3.5-turbo")}
+    if config.get("prompt_cache"):
+        import hashlib
+        # 相同前缀的请求带相同的键，便于服务端路由到已缓存该前缀的节点
+        head["prompt_cache_key"] = "translator-" + hashlib.md5(f"{head['model']}|{prompt}".encode('utf-8')).hexdigest()[:16]
+    # 模型和系统提示词固定在最前面，服务端的前缀缓存才能命中
+    prefix = _dumps(head)[:-1] + ',"messages":[' + _dumps({"role": "system", "content": prompt})
+    template = {
+        "url": config.get("api_url", "https://api.openai.com/v1/chat/completions"),
+        "headers": headers,
+        "stream_headers": dict(headers, Accept="text/event-stream"),
+        "prefix": prefix
+    }
+    _request_templates[signature] = template
+    return template
+
+def _dumps(value):
+    """紧凑序列化：不输出多余空格，中文不转义为\\uXXXX"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def build_request(text, config, stream=False, history=None, max_tokens=1000):
+    """构建翻译请求，返回(URL, 请求体, 请求头)；history为插入在系统提示词之后的上文消息"""
+    template = get_request_template(config)
+    messages = [*(history or []), {"role": "user", "content": text}]
+    body = template["prefix"] + "".join("," + _dumps(message) for message in messages)
+    body += f'],"temperature":0.7,"max_tokens":{int(max_tokens)}'
+    if stream:
+        body += ',"stream":true'
+    body += "}"
+    return template["url"], body.encode('utf-8'), template["stream_headers"] if stream else template["headers"]
+
+def make_result(status, text, cached=False, usage=None, http_status=None, retry_after=None):
+    """构建翻译结果，各层据此判断成败，不再解析文本前缀
+
+    status为"ok"（text为译文）或"error"（text为显示给用户的错误信息）；cached表示译文来自缓存；
+    latency由translate_text()等入口填入总耗时（秒）；usage为接口返回的token用量；
+    出错时http_status为HTTP状态码（网络错误等为None），retry_after为服务端要求等待的秒数。
+    """
+    return {
+        "status": status,
+        "text": text,
+        "cached": cached,
+        "latency": None,
+        "usage": usage,
+        "http_status": http_status,
+        "retry_after": retry_after
+    }
+
+def is_ok(result):
+    """判断结果是否为译文"""
+    return result.get("status") == "ok"
+
+def describe_error(e):
+    """把请求异常转换为错误结果，HTTP错误带上状态码和Retry-After"""
+    import urllib.error
+    if isinstance(e, urllib.error.HTTPError):
+        import rate_limit
+        retry_after = rate_limit.parse_retry_after(e.headers.get('Retry-After')) if e.headers else None
+        message = f"HTTP错误：{e.code} {e.reason}"
+        error_msg = e.read().decode('utf-8')
+        try:
+            error_data = json.loads(error_msg)
+            if 'error' in error_data:
+                message = f"API错误：{error_data['error'].get('message', '未知错误')}"
+        except:
+            pass
+        return make_result("error", message, http_status=e.code, retry_after=retry_after)
+    if isinstance(e, urllib.error.URLError):
+        return make_result("error", f"网络错误：{e.reason}")
+    return make_result("error", f"翻译失败：{str(e)}")
+
+def translate_once(text, config, request):
+    """同一缓存键同时只发出一个请求，其他进程等待并复用其结果"""
+    data_dir = get_workflow_data_dir()
+    cache_key = get_cache_key(text, config)
+    owner = inflight.acquire(data_dir, cache_key)
+    if not owner:
+        cached = inflight.wait_for(data_dir, cache_key, lambda: lookup_cache(text, config, record=False))
+        if cached is not None:
+            return make_result("ok", cached, cached=True)
+        # 持有者请求失败，自己再请求一次
+    
+    result = None
+    try:
+        result = request()
+        return result
+    finally:
+        if owner and result is not None and is_ok(result):
+            # 缓存写入之后才释放，等待中的进程释放前总能查到结果
+            defer(lambda: inflight.release(data_dir, cache_key))
+        elif owner:
+            # 请求失败时没有要写入的缓存，立即释放，等待中的进程自己重试
+            inflight.release(data_dir, cache_key)
+
+def finish_result(result, started):
+    """填入总耗时；失败时在性能记录中标记错误（HTTP状态码，其他错误为other）"""
+    result["latency"] = time.perf_counter() - started
+    if not is_ok(result):
+        metrics.tag("error", result["http_status"] or "other")
+    return result
+
+def translate_text(text, config, record=True):
+    """调用API翻译文本，返回结果字典（见make_result）；record为False时缓存查询不计入命中统计"""
+    started = time.perf_counter()
+    return finish_result(_translate_text(text, config, record), started)
+
+def _translate_text(text, config, record=True):
+    """translate_text()的实际翻译过程：缓存、分段、续译或完整请求"""
+    if not config.get("api_key"):
+        return make_result("error", "错误：请先配置API Key（使用 tset 命令）")
+    
+    # 检查缓存
+    cached = lookup_cache(text, config, record)
+    if cached is not None:
+        metrics.tag("outcome", "cache")
+        return make_result("ok", cached, cached=True)
+    failure = lookup_failure(text, config)
+    if failure is not None:
+        return failure
+    
+    metrics.tag("outcome", "api")
+    chunks = split_chunks(text, int(config.get("chunk_tokens", CHUNK_TOKENS)))
+    if len(chunks) > 1:
+        return translate_chunks(text, config, chunks)
+    
+    if config.get("speculative"):
+        # 分句前缀已预翻译时只需续译剩余部分
+        prefix, prefix_translation = find_cached_prefix(text, config)
+        if prefix:
+            return translate_once(
+                text, config,
+                lambda: request_continuation(text, config, prefix, prefix_translation)
+            )
+    
+    return translate_once(text, config, lambda: request_translation(text, config))
+
+def estimate_tokens(text):
+    """粗略估算token数：中文约每字1个token，其他字符约每4个1个token"""
+    cjk = sum(map(len, CHINESE_PATTERN.findall(text)))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+def split_chunks(text, token_budget=CHUNK_TOKENS):
+    """把长文本按句子切分为不超过token预算的段落，返回[(段落, 之后的分隔符)]
+
+    换行处总是分段，修改某一段只会影响该段的缓存；同一自然段内的句子按预算合并。
+    """
+    chunks = []
+    current = ""
+    for match in SENTENCE_PATTERN.finditer(text):
+        sentence = match.group()
+        if sentence.startswith("\n"):
+            # 换行：结束当前段落，分隔符保留原有的换行
+            if current.strip():
+                chunks.append((current.strip(), sentence))
+            elif chunks:
+                chunks[-1] = (chunks[-1][0], chunks[-1][1] + sentence)
+            current = ""
+            continue
+        if current.strip() and estimate_tokens(current) + estimate_tokens(sentence) > token_budget:
+            chunks.append((current.strip(), " "))
+            current = ""
+        current += sentence
+    if current.strip():
+        chunks.append((current.strip(), ""))
+    elif chunks:
+        chunks[-1] = (chunks[-1][0], "")
+    return chunks
+
+def translate_chunks(text, config, chunks, on_progress=None):
+    """并发翻译各段（每段单独缓存），按原顺序拼接
+
+    on_progress在前面的段落连续完成时回调已拼接的译文。
+    """
+    import concurrent.futures
+    results = [None] * len(chunks)
+    # 缓存键相同（规范化后相同）的段落只翻译一次：同一缓存键的请求锁要到输出结果后才释放
+    positions = {}
+    for index, (chunk, _) in enumerate(chunks):
+        positions.setdefault(get_cache_key(chunk, config), (chunk, []))[1].append(index)
+    concurrency = max(1, int(config.get("chunk_concurrency", CHUNK_CONCURRENCY)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # 各段在线程池中翻译，复制上下文使query_cancel()对各段同样生效；整段查询已计入缓存统计，各段不再计入
+        futures = {
+            executor.submit(contextvars.copy_context().run, translate_text, chunk, config, False): key
+            for key, (chunk, _) in positions.items()
+        }
+        done = 0
+        for future in concurrent.futures.as_completed(futures):
+            for index in positions[futures[future]][1]:
+                results[index] = future.result()
+            if on_progress is None:
+                continue
+            while done < len(results) and results[done] is not None:
+                done += 1
+            if done:
+                on_progress(join_chunks(chunks[:done], [result["text"] for result in results[:done]]))
+    
+    usage = {}
+    for result in results:
+        if not is_ok(result):
+            # 任意一段失败时整体按失败处理，已成功的段落仍保留在缓存中
+            return result
+        for name, value in (result["usage"] or {}).items():
+            if isinstance(value, int):
+                usage[name] = usage.get(name, 0) + value
+    
+    translated_text = join_chunks(chunks, [result["text"] for result in results])
+    store_cache(text, config, translated_text)
+    return make_result("ok", translated_text, cached=all(result["cached"] for result in results), usage=usage or None)
+
+def join_chunks(chunks, translations):
+    """按原分隔符拼接各段译文"""
+    return "".join(
+        translated + separator for (_, separator), translated in zip(chunks, translations)
+    ).strip()
+
+class query_cancel:
+    """在代码块内发出的请求都可以被cancel（http_client.CancelToken）取消；用法：with query_cancel(token): ..."""
+
+    def __init__(self, cancel):
+        self.cancel = cancel
+
+    def __enter__(self):
+        self._reset = _query_cancel.set(self.cancel)
+        return self
+
+    def __exit__(self, *exc_info):
+        _query_cancel.reset(self._reset)
+
+def route_request(config, kind, request):
+    """按端点选择接口发送请求，返回结果字典
+
+    request(endpoint, cancel, on_first)用endpoint的配置发出一次请求并返回结果字典，cancel用于取消请求，
+    on_first()在收到第一段内容时调用，返回False时应放弃请求。配置了多个端点（endpoints）时延迟低的
+    优先，失败自动换下一个，开启hedge_requests时超过首选端点p95延迟仍未返回会向下一个端点再发一个
+    请求，采用先返回的结果。连续失败的端点会被熔断，冷却期内直接返回其上次的错误。
+    """
+    import endpoint_router
+    data_dir = get_workflow_data_dir()
+    endpoints = endpoint_router.get_endpoints(config)
+    state = endpoint_router.load_state(data_dir)
+    threshold = int(config.get("breaker_failures", endpoint_router.BREAKER_FAILURES))
+    
+    def attempt(endpoint, cancel=None, claim=None):
+        """熔断检查后发出请求，并登记延迟或失败"""
+        if not endpoint_router.allow(data_dir, state, endpoint, threshold):
+            return breaker_result(endpoint_router.get_entry(state, endpoint))
+        probing = endpoint_router.is_probing(state, endpoint, threshold)
+        started = time.perf_counter()
+        first = []
+        
+        def on_first():
+            first.append(time.perf_counter() - started)
+            return claim() if claim is not None else True
+        
+        try:
+            result = request(endpoint, cancel, on_first)
+        finally:
+            if probing:
+                # 立即交还探测名额，不依赖收尾操作：被取消、内容错误或收到SIGTERM时也不会一直占着
+                endpoint_router.release_probe(data_dir, endpoint)
+        elapsed = time.perf_counter() - started
+        if cancel is not None and cancel.cancelled:
+            # 被其他请求或后续按键取消，已等待的时间只是延迟的下限
+            if len(endpoints) > 1:
+                defer(lambda: endpoint_router.record(data_dir, endpoint, kind, elapsed, lower_bound=True))
+        elif not is_ok(result) and not is_content_error(result):
+            defer(lambda: endpoint_router.record(data_dir, endpoint, kind, None, error=result))
+        elif is_ok(result) and (len(endpoints) > 1 or endpoint_router.get_entry(state, endpoint).get("failures")):
+            # 只有一个接口时不需要延迟数据，只在从失败中恢复时写状态文件
+            latency = first[0] if first else elapsed
+            defer(lambda: endpoint_router.record(data_dir, endpoint, kind, latency))
+        return result
+    
+    cancel = _query_cancel.get()
+    if len(endpoints) == 1:
+        if cancel is None:
+            return attempt(config)
+        import http_client
+        return attempt(config, http_client.CancelToken(cancel))
+    
+    ranked = endpoint_router.rank(state, endpoints, kind)
+    delay = endpoint_router.hedge_delay(state, ranked[0], kind) if config.get("hedge_requests") else None
+    
+    def make_call(endpoint):
+        def call(cancel, claim):
+            result = attempt(endpoint, cancel, claim)
+            return (result, None) if is_ok(result) else (None, result)
+        return call
+    
+    result, error = endpoint_router.run_routed([make_call(endpoint) for endpoint in ranked], delay, cancel)
+    if result is not None:
+        return result
+    return describe_error(error) if isinstance(error, Exception) else error
+
+def breaker_result(entry):
+    """熔断期间不发请求，直接返回端点上次的错误"""
+    metrics.tag("breaker", True)
+    wait = max(0.0, entry.get("down_until", 0) - time.time())
+    message = entry.get("last_error") or "翻译失败：接口暂时不可用"
+    hint = f"{wait:.0f}秒后重试" if wait >= 1 else "正在重试"
+    return make_result(
+        "error",
+        f"{message}（接口连续失败，暂停请求，{hint}）",
+        http_status=entry.get("last_status"),
+        retry_after=wait
+    )
+
+def fetch_completion(url, body, headers, cancel=None):
+    """发送请求，返回结果字典"""
+    import http_client
+    try:
+        with http_client.urlopen(url, data=body, headers=headers, timeout=30, cancel=cancel) as response:
+            result = json.loads(response.read().decode('utf-8'))
+            metrics.add_timings(response.timings)
+            metrics.add_usage(result.get('usage'))
+            
+            if 'choices' in result and len(result['choices']) > 0:
+                return make_result("ok", result['choices'][0]['message']['content'].strip(), usage=result.get('usage'))
+            else:
+                return make_result("error", "翻译失败：API返回格式错误")
+                
+    except Exception as e:
+        return describe_error(e)
+
+def request_translation(text, config):
+    """发送翻译请求并缓存结果"""
+    result = route_request(
+        config,
+        "complete",
+        lambda endpoint, cancel, on_first: fetch_completion(*build_request(text, endpoint), cancel=cancel)
+    )
+    if is_ok(result):
+        # 保存到缓存
+        store_cache(text, config, result["text"])
+    else:
+        store_failure(text, config, result)
+    return result
+
+def get_clause_prefix(text):
+    """取最后一个分句标点之前的完整部分，没有时返回空字符串"""
+    text = text.rstrip()
+    if text and text[-1] in CLAUSE_PUNCTUATION:
+        return text.rstrip(CLAUSE_PUNCTUATION).rstrip()
+    cut = max(text.rfind(mark) for mark in CLAUSE_PUNCTUATION)
+    return text[:cut].rstrip(CLAUSE_PUNCTUATION).rstrip() if cut > 0 else ""
+
+def find_cached_prefix(text, config):
+    """从长到短查找已有缓存译文的分句前缀，返回(前缀, 译文)"""
+    prefix = get_clause_prefix(text)
+    for _ in range(MAX_PREFIX_LOOKUPS):
+        if not prefix:
+            break
+        cached = lookup_cache(prefix, config, record=False)
+        if cached is not None:
+            return prefix, cached
+        prefix = get_clause_prefix(prefix)
+    return None, None
+
+def request_continuation(text, config, prefix, prefix_translation):
+    """前缀已有译文时只翻译剩余部分，再与前缀译文拼接"""
+    rest = text[len(prefix):].lstrip(CLAUSE_PUNCTUATION).strip()
+    history = [
+        {"role": "user", "content": prefix},
+        {"role": "assistant", "content": prefix_translation}
+    ]
+    instruction = f"接着上文继续翻译下面这部分，只输出这部分的英文译文，使其能自然地接在上一句译文后面：\n{rest}"
+    result = route_request(
+        config,
+        "complete",
+        lambda endpoint, cancel, on_first: fetch_completion(*build_request(instruction, endpoint, history=history), cancel=cancel)
+    )
+    if not is_ok(result):
+        # 续译失败时退回完整翻译
+        return request_translation(text, config)
+    
+    translated_text = f"{prefix_translation} {result['text']}"
+    store_cache(text, config, translated_text)
+    return make_result("ok", translated_text, usage=result["usage"])
+
+def translate_text_stream(text, config, on_progress, record=True):
+    """以流式(SSE)方式调用API翻译文本，每收到新内容时回调on_progress(已翻译部分)，返回结果字典"""
+    started = time.perf_counter()
+    return finish_result(_translate_text_stream(text, config, on_progress, record), started)
+
+def _translate_text_stream(text, config, on_progress, record=True):
+    """translate_text_stream()的实际翻译过程"""
+    if not config.get("api_key"):
+        return make_result("error", "错误：请先配置API Key（使用 tset 命令）")
+    
+    cached = lookup_cache(text, config, record)
+    if cached is not None:
+        return make_result("ok", cached, cached=True)
+    failure = lookup_failure(text, config)
+    if failure is not None:
+        return failure
+    
+    chunks = split_chunks(text, int(config.get("chunk_tokens", CHUNK_TOKENS)))
+    if len(chunks) > 1:
+        return translate_chunks(text, config, chunks, on_progress)
+    
+    if config.get("speculative") and find_cached_prefix(text, config)[0]:
+        # 续译只需生成剩余部分，无需流式；缓存已查过
+        return translate_text(text, config, record=False)
+    
+    return translate_once(text, config, lambda: request_translation_stream(text, config, on_progress))
+
+def request_translation_stream(text, config, on_progress):
+    """发送流式翻译请求并缓存结果"""
+    result = route_request(
+        config,
+        "stream",
+        lambda endpoint, cancel, on_first: stream_completion(text, endpoint, on_progress, cancel, on_first)
+    )
+    if is_ok(result):
+        store_cache(text, config, result["text"])
+    else:
+        store_failure(text, config, result)
+    return result
+
+def stream_completion(text, config, on_progress, cancel=None, on_first=None):
+    """发送流式请求，返回结果字典
+
+    收到第一段内容时先调用on_first()，返回False说明其他端点的请求已胜出，放弃本次请求。
+    """
+    import http_client
+    url, body, headers = build_request(text, config, stream=True)
+    try:
+        with http_client.urlopen(url, data=body, headers=headers, timeout=30, cancel=cancel) as response:
+            content_type = response.getheader('Content-Type', '')
+            if 'text/event-stream' not in content_type:
+                # 接口不支持流式时按普通响应处理
+                result = json.loads(response.read().decode('utf-8'))
+                metrics.add_timings(response.timings)
+                metrics.add_usage(result.get('usage'))
+                if 'choices' in result and len(result['choices']) > 0:
+                    if on_first is not None and not on_first():
+                        return make_result("error", "翻译失败：请求已取消")
+                    return make_result("ok", result['choices'][0]['message']['content'].strip(), usage=result.get('usage'))
+                return make_result("error", "翻译失败：API返回格式错误")
+            
+            parts = []
+            usage = None
+            # 收到[DONE]或finish_reason才算完整，连接提前断开时的半截译文不能当作结果缓存
+            finished = False
+            for line in response:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == b"[DONE]":
+                    finished = True
+                    break
+                chunk = json.loads(payload.decode('utf-8'))
+                metrics.add_usage(chunk.get('usage'))
+                usage = chunk.get('usage') or usage
+                if not chunk.get('choices'):
+                    continue
+                if chunk['choices'][0].get('finish_reason'):
+                    finished = True
+                delta = chunk['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    if not parts and on_first is not None and not on_first():
+                        return make_result("error", "翻译失败：请求已取消")
+                    parts.append(delta)
+                    on_progress("".join(parts).strip())
+            
+            metrics.add_timings(response.timings)
+            translated_text = "".join(parts).strip()
+            if not finished:
+                return make_result("error", "翻译失败：流式响应意外中断")
+            if not translated_text:
+                return make_result("error", "翻译失败：API返回格式错误")
+            return make_result("ok", translated_text, usage=usage)
+    
+    except Exception as e:
+        return describe_error(e)
+
+def claim_interval(name, interval):
+    """距上次执行name已超过interval秒时记录本次时间并返回True，用于限制预热频率（跨进程）"""
+    stamp_file = os.path.join(get_workflow_data_dir(), f"{name}.stamp")
+    try:
+        if time.time() - os.path.getmtime(stamp_file) < interval:
+            return False
+    except OSError:
+        pass
+    try:
+        with open(stamp_file, 'w'):
+            pass
+    except OSError:
+        return False
+    return True
+
+def warm_up(config):
+    """预先建立到各端点的连接（DNS解析、TCP、TLS握手）；配置了warmup_request_minutes时按间隔发送极小的请求"""
+    import http_client
+    import endpoint_router
+    for endpoint in endpoint_router.get_endpoints(config):
+        try:
+            http_client.preconnect(endpoint.get("api_url", "https://api.openai.com/v1/chat/completions"))
+        except Exception:
+            pass
+    
+    minutes = float(config.get("warmup_request_minutes") or 0)
+    if minutes > 0 and claim_interval("warmup_request", minutes * 60):
+        # 服务端借此加载模型并缓存系统提示词前缀
+        fetch_completion(*build_request(WARMUP_TEXT, config, max_tokens=1))
\ No newline at end of file